@@ -1,18 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from reference_parser import ReferenceParser
 from pubmed_search import PubMedSearcher
 from content_downloader import ContentDownloader
+from corpus_paths import TXT_DIR, PDF_DIR, REF_DIR
 from database import DatabaseManager
 from job_processor import JobProcessor
+from cache import TTLCache
+from json_provider import ORJSONProvider
 import logging
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # Configure logging
@@ -24,7 +31,47 @@ db_manager = DatabaseManager()
 reference_parser = ReferenceParser()
 pubmed_searcher = PubMedSearcher()
 content_downloader = ContentDownloader()
-job_processor = JobProcessor(db_manager)
+# The job processor shares the components above so there is a single
+# rate limiter, HTTP session and cache for each NCBI client
+job_processor = JobProcessor(db_manager, reference_parser, pubmed_searcher, content_downloader)
+entry_cache = TTLCache(ttl=60, maxsize=1024)
+
+# How long a stored PMID -> PMC ID lookup is trusted before elink is asked again
+PMC_LOOKUP_MAX_AGE = timedelta(days=30)
+# Concurrent reference downloads in /api/extract-references; NCBI's rate limit still applies
+REFERENCE_EXTRACTION_WORKERS = 10
+# Removes corpus files of deleted entries after the response has been sent
+cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cleanup-worker')
+
+# A stored PMC ID: digits, optionally with a "PMC" prefix or a float suffix from older files
+_PMC_ID_RE = re.compile(r'(?:PMC)?(\d+)(?:\.0*)?', re.IGNORECASE)
+
+def normalize_pmc_id(pmc_id):
+    """Return the digits of a stored PMC ID, or None if it isn't a recognizable PMC ID."""
+    match = _PMC_ID_RE.fullmatch(str(pmc_id).strip())
+    return match.group(1) if match else None
+
+def get_cached_entry(pmid):
+    """Get an entry by PMID, consulting the in-process entry cache first."""
+    cache_key = f"entry:{pmid}"
+    entry = entry_cache.get(cache_key)
+    if entry is None:
+        entry = db_manager.get_entry_by_pmid(pmid)
+        if entry:
+            entry_cache.set(cache_key, entry)
+    return entry
+
+def unlink_files(paths):
+    """Delete the given files if they exist, logging each removal."""
+    for path in paths:
+        # A single unlink, treating a missing file as already deleted
+        try:
+            os.remove(path)
+            logger.info(f"Deleted file: {path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting file {path}: {str(e)}")
 
 @app.route('/api/process-references', methods=['POST'])
 def process_references():
@@ -36,13 +83,9 @@ def process_references():
         if not references_text:
             return jsonify({'error': 'No references provided'}), 400
         
-        # Quick parse to count references for job tracking
-        try:
-            references = reference_parser.parse_references(references_text)
-            total_refs = len(references)
-        except Exception as e:
-            logger.error(f"Error parsing references for job creation: {str(e)}")
-            return jsonify({'error': f'Failed to parse references: {str(e)}'}), 400
+        # Cheap estimate for job tracking; the job worker does the real GPT parse
+        # and corrects the count once it is known
+        total_refs = reference_parser.estimate_count(references_text)
         
         # Create job
         job_id = db_manager.create_job(references_text, total_refs)
@@ -62,79 +105,6 @@ def process_references():
         logger.error(f"Error creating processing job: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def process_single_reference(ref_data):
-    try:
-        # Check for duplicate PMID
-        if ref_data.get('pmid') and db_manager.pmid_exists(ref_data['pmid']):
-            return {
-                'status': 'duplicate',
-                'pmid': ref_data['pmid'],
-                'message': 'PMID already exists in database'
-            }
-        
-        # Search PubMed
-        pubmed_result = pubmed_searcher.search_article(ref_data['title'])
-        
-        if not pubmed_result:
-            # Save failed extraction
-            db_manager.add_entry({
-                'pmid': None,
-                'filename': None,
-                'extraction_status': 'pubmed_search_failed',
-                'txt_available': False,
-                'pdf_available': False,
-                'ref_available': False,
-                'original_reference': ref_data['original_text'],
-                'extracted_title': ref_data['title'],
-                'found_title': None,
-                'first_author': ref_data.get('first_author', '')
-            })
-            return {
-                'status': 'failed',
-                'step': 'pubmed_search',
-                'extracted_title': ref_data['title']
-            }
-        
-        # Download content if available
-        pmid = pubmed_result['pmid']
-        filename = f"{ref_data['first_author']}_{pmid}"
-        
-        txt_downloaded = content_downloader.download_fulltext(pmid, filename)
-        pdf_downloaded = content_downloader.download_pdf(pmid, filename)
-        ref_downloaded = content_downloader.download_references(pmid, filename)
-        
-        # Save to database
-        entry_data = {
-            'pmid': pmid,
-            'filename': filename,
-            'extraction_status': 'success',
-            'txt_available': txt_downloaded,
-            'pdf_available': pdf_downloaded,
-            'ref_available': ref_downloaded,
-            'original_reference': ref_data['original_text'],
-            'extracted_title': ref_data['title'],
-            'found_title': pubmed_result['title'],
-            'first_author': ref_data['first_author']
-        }
-        
-        db_manager.add_entry(entry_data)
-        
-        return {
-            'status': 'success',
-            'pmid': pmid,
-            'filename': filename,
-            'txt_available': txt_downloaded,
-            'pdf_available': pdf_downloaded,
-            'ref_available': ref_downloaded
-        }
-    
-    except Exception as e:
-        logger.error(f"Error processing reference: {str(e)}")
-        return {
-            'status': 'error',
-            'message': str(e)
-        }
-
 @app.route('/api/entries', methods=['GET'])
 def get_entries():
     try:
@@ -149,7 +119,7 @@ def get_entries():
 @app.route('/api/entries/<pmid>', methods=['GET'])
 def get_entry(pmid):
     try:
-        entry = db_manager.get_entry_by_pmid(pmid)
+        entry = get_cached_entry(pmid)
         if entry:
             return jsonify({'entry': entry})
         else:
@@ -172,7 +142,7 @@ def get_failed_extractions():
 @app.route('/api/content/txt/<pmid>', methods=['GET'])
 def get_txt_content(pmid):
     try:
-        entry = db_manager.get_entry_by_pmid(pmid)
+        entry = get_cached_entry(pmid)
         if not entry:
             return jsonify({'error': 'Entry not found'}), 404
         
@@ -183,15 +153,14 @@ def get_txt_content(pmid):
         if not filename:
             return jsonify({'error': 'Filename not found'}), 404
         
-        txt_path = os.path.join('corpus', 'txt', f'{filename}.txt')
+        txt_path = os.path.join(TXT_DIR, f'{filename}.txt')
         
-        if not os.path.exists(txt_path):
+        # Let send_file fail on a missing file rather than checking for it first.
+        # max_age=0 makes clients revalidate, so unchanged files are answered with a 304
+        try:
+            return send_file(txt_path, mimetype='text/plain; charset=utf-8', conditional=True, max_age=0)
+        except FileNotFoundError:
             return jsonify({'error': 'TXT file not found on disk'}), 404
-        
-        with open(txt_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        return jsonify({'content': content})
     
     except Exception as e:
         logger.error(f"Error retrieving TXT content: {str(e)}")
@@ -200,7 +169,7 @@ def get_txt_content(pmid):
 @app.route('/api/content/pdf/<pmid>', methods=['GET'])
 def get_pdf_content(pmid):
     try:
-        entry = db_manager.get_entry_by_pmid(pmid)
+        entry = get_cached_entry(pmid)
         if not entry:
             return jsonify({'error': 'Entry not found'}), 404
         
@@ -211,13 +180,14 @@ def get_pdf_content(pmid):
         if not filename:
             return jsonify({'error': 'Filename not found'}), 404
         
-        pdf_path = os.path.join('corpus', 'pdf', f'{filename}.pdf')
+        pdf_path = os.path.join(PDF_DIR, f'{filename}.pdf')
         
-        if not os.path.exists(pdf_path):
+        # Let send_file fail on a missing file rather than checking for it first.
+        # max_age=0 makes clients revalidate, so unchanged files are answered with a 304
+        try:
+            return send_file(pdf_path, as_attachment=False, mimetype='application/pdf', conditional=True, max_age=0)
+        except FileNotFoundError:
             return jsonify({'error': 'PDF file not found on disk'}), 404
-        
-        from flask import send_file
-        return send_file(pdf_path, as_attachment=False, mimetype='application/pdf')
     
     except Exception as e:
         logger.error(f"Error retrieving PDF content: {str(e)}")
@@ -226,7 +196,7 @@ def get_pdf_content(pmid):
 @app.route('/api/content/ref/<pmid>', methods=['GET'])
 def get_ref_content(pmid):
     try:
-        entry = db_manager.get_entry_by_pmid(pmid)
+        entry = get_cached_entry(pmid)
         if not entry:
             return jsonify({'error': 'Entry not found'}), 404
         
@@ -237,15 +207,14 @@ def get_ref_content(pmid):
         if not filename:
             return jsonify({'error': 'Filename not found'}), 404
         
-        ref_path = os.path.join('corpus', 'references', f'{filename}_ref.txt')
+        ref_path = os.path.join(REF_DIR, f'{filename}_ref.txt')
         
-        if not os.path.exists(ref_path):
+        # Let send_file fail on a missing file rather than checking for it first.
+        # max_age=0 makes clients revalidate, so unchanged files are answered with a 304
+        try:
+            return send_file(ref_path, mimetype='text/plain; charset=utf-8', conditional=True, max_age=0)
+        except FileNotFoundError:
             return jsonify({'error': 'Reference file not found on disk'}), 404
-        
-        with open(ref_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        return jsonify({'content': content})
     
     except Exception as e:
         logger.error(f"Error retrieving reference content: {str(e)}")
@@ -254,33 +223,23 @@ def get_ref_content(pmid):
 @app.route('/api/entries/<pmid>', methods=['DELETE'])
 def delete_entry(pmid):
     try:
-        entry = db_manager.get_entry_by_pmid(pmid)
+        entry = get_cached_entry(pmid)
         if not entry:
             return jsonify({'error': 'Entry not found'}), 404
         
-        # Delete associated files if they exist
-        filename = entry.get('filename')
-        if filename:
-            txt_path = os.path.join('corpus', 'txt', f'{filename}.txt')
-            pdf_path = os.path.join('corpus', 'pdf', f'{filename}.pdf')
-            ref_path = os.path.join('corpus', 'references', f'{filename}_ref.txt')
-            
-            if os.path.exists(txt_path):
-                os.remove(txt_path)
-                logger.info(f"Deleted TXT file: {txt_path}")
-            
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-                logger.info(f"Deleted PDF file: {pdf_path}")
-            
-            if os.path.exists(ref_path):
-                os.remove(ref_path)
-                logger.info(f"Deleted reference file: {ref_path}")
-        
         # Delete entry from database
         success = db_manager.delete_entry_by_pmid(pmid)
+        entry_cache.delete(f"entry:{pmid}")
         
         if success:
+            # Delete associated files in the background instead of delaying the response
+            filename = entry.get('filename')
+            if filename:
+                cleanup_executor.submit(unlink_files, [
+                    os.path.join(TXT_DIR, f'{filename}.txt'),
+                    os.path.join(PDF_DIR, f'{filename}.pdf'),
+                    os.path.join(REF_DIR, f'{filename}_ref.txt')
+                ])
             return jsonify({'message': 'Entry deleted successfully'}), 200
         else:
             return jsonify({'error': 'Failed to delete entry from database'}), 500
@@ -300,6 +259,7 @@ def delete_entry_by_timestamp():
         
         # Delete entry from database by timestamp
         success = db_manager.delete_entry_by_timestamp(created_at)
+        entry_cache.clear()
         
         if success:
             return jsonify({'message': 'Entry deleted successfully'}), 200
@@ -314,6 +274,7 @@ def delete_entry_by_timestamp():
 def fix_filenames():
     try:
         success = db_manager.fix_filename_format()
+        entry_cache.clear()
         if success:
             return jsonify({'message': 'Filename format fixed successfully'}), 200
         else:
@@ -329,25 +290,64 @@ def extract_references():
         # Get all entries that don't have references yet
         entries = db_manager.get_entries_without_references()
         extracted_count = 0
+        ref_availability = {}  # PMID -> whether references were downloaded
         
+        # Reuse stored PMC lookups and refresh the rest with batched elink requests
+        tasks = []  # (pmid, filename, pmc_id or None if unknown)
+        stale_pmids = []
         for entry in entries:
             pmid = entry.get('pmid')
             filename = entry.get('filename')
             
             if pmid and filename:
-                try:
-                    ref_downloaded = content_downloader.download_references(str(pmid), filename)
-                    if ref_downloaded:
-                        # Update database to mark references as available
-                        db_manager.update_ref_availability(str(pmid), True)
-                        extracted_count += 1
-                        logger.info(f"Extracted references for PMID {pmid}")
-                    else:
-                        # Mark as not available to avoid retrying
-                        db_manager.update_ref_availability(str(pmid), False)
-                except Exception as e:
-                    logger.error(f"Error extracting references for PMID {pmid}: {str(e)}")
-                    db_manager.update_ref_availability(str(pmid), False)
+                pmid = str(pmid)
+                lookup_at = entry.get('pmc_lookup_at')
+                fresh = lookup_at and datetime.now() - datetime.fromisoformat(lookup_at) < PMC_LOOKUP_MAX_AGE
+                if fresh and not entry.get('pmc_id'):
+                    # Known not to be in PMC, so there are no references to fetch
+                    continue
+                
+                pmc_id = normalize_pmc_id(entry['pmc_id']) if fresh else None
+                if pmc_id:
+                    tasks.append((pmid, filename, pmc_id))
+                else:
+                    # Never looked up, looked up too long ago, or stored in a form that can't be used
+                    stale_pmids.append(pmid)
+                    tasks.append((pmid, filename, None))
+        
+        fresh_pmc_ids = content_downloader.get_pmc_ids_batch(stale_pmids)
+        db_manager.update_pmc_ids_bulk(fresh_pmc_ids)
+        
+        downloads = []
+        for pmid, filename, pmc_id in tasks:
+            pmc_id = pmc_id or fresh_pmc_ids.get(pmid)
+            if pmid in fresh_pmc_ids and not pmc_id:
+                # Not in PMC, so there are no references to fetch
+                continue
+            downloads.append((pmid, filename, pmc_id))
+        
+        def download(task):
+            pmid, filename, pmc_id = task
+            try:
+                return pmid, content_downloader.download_references(pmid, filename, pmc_id)
+            except Exception as e:
+                logger.error(f"Error extracting references for PMID {pmid}: {str(e)}")
+                return pmid, False
+        
+        # Downloads overlap their network waits; results are collected on this thread
+        with ThreadPoolExecutor(max_workers=REFERENCE_EXTRACTION_WORKERS) as executor:
+            for pmid, ref_downloaded in executor.map(download, downloads):
+                # Unavailable references are recorded too, to avoid retrying
+                ref_availability[pmid] = ref_downloaded
+                if ref_downloaded:
+                    extracted_count += 1
+                    logger.info(f"Extracted references for PMID {pmid}")
+        
+        # Update the database once for all entries
+        db_manager.update_ref_availability_bulk(ref_availability)
+        
+        # Reference availability changed for these entries
+        entry_cache.clear()
         
         return jsonify({
             'message': f'Reference extraction completed. Extracted references for {extracted_count} entries.',
@@ -411,6 +411,9 @@ def cancel_job(job_id):
         if not job:
             return jsonify({'error': 'Job not found'}), 404
         
+        # Drop the job from the queue, or stop it after its current reference
+        job_processor.cancel_job(job_id)
+        
         # Update job status to cancelled
         success = db_manager.update_job_status(job_id, 'cancelled')
         
@@ -427,24 +430,7 @@ def cancel_job(job_id):
 def list_jobs():
     """List recent jobs."""
     try:
-        # This is a simple implementation - you could add pagination/filtering
-        if not os.path.exists(db_manager.jobs_csv):
-            return jsonify({'jobs': []})
-        
-        import pandas as pd
-        jobs_df = pd.read_csv(db_manager.jobs_csv)
-        
-        # Sort by created_at descending, limit to recent jobs
-        jobs_df = jobs_df.sort_values('created_at', ascending=False).head(20)
-        
-        jobs = []
-        for _, row in jobs_df.iterrows():
-            job = row.to_dict()
-            # Replace NaN with None
-            for key, value in job.items():
-                if pd.isna(value):
-                    job[key] = None
-            jobs.append(job)
+        jobs = db_manager.list_jobs(limit=20)
         
         return jsonify({'jobs': jobs})
     
@@ -0,0 +1,158 @@
+import threading
+import time
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    def __init__(self, ttl: float, maxsize: Optional[int] = None):
+        self.ttl = ttl  # Seconds before a cached value expires
+        self.maxsize = maxsize  # Least recently used keys are evicted beyond this size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a cached value by key.
+        Returns None if the key is missing or has expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            value, expires_at = item
+            if time.time() >= expires_at:
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value under key for ttl seconds, or the configured time-to-live."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put(key, value, expires_at)
+
+    def _put(self, key: str, value: Any, expires_at: float):
+        """Store a value and evict the least recently used keys beyond maxsize. Caller holds the lock."""
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        """Remove a single key from the cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all keys from the cache."""
+        with self._lock:
+            self._data.clear()
+        logger.info("Cleared cache")
+
+def hash_key(prefix: str, text: str, ignore_case: bool = True) -> str:
+    """Build a fixed-length cache key from arbitrary text, case-insensitively unless ignore_case is False."""
+    text = text.strip()
+    if ignore_case:
+        text = text.lower()
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return f"{prefix}:{digest}"
+
+class PersistentTTLCache(TTLCache):
+    """
+    TTLCache whose values survive restarts.
+    Every stored value is appended to a JSON lines file, which is replayed on startup
+    and rewritten without expired or replaced values when it has grown stale, both on
+    startup and once more than max_dead_lines of it no longer hold a cached value.
+    Values must be JSON serializable.
+    """
+    def __init__(self, path: str, ttl: float, maxsize: Optional[int] = None):
+        super().__init__(ttl, maxsize)
+        self.path = path
+        self.max_dead_lines = 2 * maxsize if maxsize is not None else 1024
+        self._line_count = 0  # Lines in the cache file, live or not
+        self._load()
+
+    def _load(self):
+        """Replay the cache file into memory, compacting it if it holds stale lines."""
+        try:
+            f = open(self.path, encoding='utf-8')
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+        line_count = 0
+        with f:
+            for line in f:
+                line_count += 1
+                try:
+                    record = json.loads(line)
+                    key, value, expires_at = record['key'], record['value'], record['expires_at']
+                except (ValueError, KeyError, TypeError):
+                    # A line cut short by a crash mid-write
+                    continue
+                if expires_at > now:
+                    self._put(key, value, expires_at)
+                else:
+                    self._data.pop(key, None)
+
+        logger.info(f"Loaded {len(self._data)} cached values from {self.path}")
+        self._line_count = line_count
+        if line_count > len(self._data):
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the cache file with only the values currently held in memory. Caller holds the lock."""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, (value, expires_at) in self._data.items():
+                    f.write(json.dumps({'key': key, 'value': value, 'expires_at': expires_at}) + '\n')
+            os.replace(tmp_path, self.path)
+            self._line_count = len(self._data)
+        except OSError as e:
+            logger.warning(f"Error compacting cache file {self.path}: {str(e)}")
+
+    def _append(self, key: str, value: Any, expires_at: float):
+        """
+        Append one record to the cache file, compacting it once replaced, deleted and
+        evicted values make up more than max_dead_lines of it. Caller holds the lock.
+        """
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'value': value, 'expires_at': expires_at}) + '\n')
+            self._line_count += 1
+        except OSError as e:
+            logger.warning(f"Error writing cache file {self.path}: {str(e)}")
+            return
+
+        if self._line_count - len(self._data) > self.max_dead_lines:
+            self._compact()
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value under key for ttl seconds, or the configured time-to-live, and persist it."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put(key, value, expires_at)
+            self._append(key, value, expires_at)
+
+    def delete(self, key: str):
+        """Remove a single key from the cache and the cache file if present."""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._append(key, None, 0)
+
+    def clear(self):
+        """Remove all keys from the cache and empty the cache file."""
+        with self._lock:
+            self._data.clear()
+            self._compact()
+        logger.info("Cleared cache")
@@ -1,47 +1,81 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import os
-from typing import Optional, Dict
+import io
+import threading
+from typing import Optional, Dict, List
 import logging
 from urllib.parse import urljoin
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
+from corpus_paths import TXT_DIR, PDF_DIR, REF_DIR
+from cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# libxml2 parser shared by all NCBI responses; tolerant of large and slightly malformed PMC XML
+_XML_PARSER = ET.XMLParser(huge_tree=True, recover=True)
+# Linked PMC IDs within an elink LinkSet, compiled once and evaluated in C
+_PMC_LINK_XPATH = ET.XPath("LinkSetDb[DbTo='pmc']/Link/Id/text()")
+
 class ContentDownloader:
     def __init__(self):
         self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
         self.pmc_base_url = "https://www.ncbi.nlm.nih.gov/pmc/"
-        self.last_request_time = 0
-        self.rate_limit_delay = 0.34  # Just over 1/3 second to ensure max 3 requests per second
+        self.last_request_time = 0  # time.monotonic() of the last request, immune to wall-clock changes
+        # An NCBI API key raises the E-utilities limit from 3 to 10 requests per second
+        self.api_key = os.getenv('NCBI_API_KEY')
+        self.rate_limit_delay = 0.11 if self.api_key else 0.34
+        self._rate_limit_lock = threading.Lock()  # Downloads may run concurrently
+        self.elink_batch_size = 200  # PMIDs per batched elink request
+        # PMID -> PMC ID lookups, with '' recorded for articles not in PMC
+        self.pmc_id_cache = TTLCache(ttl=24 * 60 * 60, maxsize=4096)
+        
+        # Reuse connections across requests instead of a new TCP/TLS handshake per call
+        self.session = requests.Session()
+        # Retry throttled and transient server errors with backoff instead of failing the download
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                        allowed_methods=['HEAD', 'GET', 'POST'])
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+        self.session.headers['Connection'] = 'keep-alive'
+        self.session.headers['User-Agent'] = 'pmid-preprocess'
         
         # Create directories if they don't exist
-        self.txt_dir = os.path.join(os.path.dirname(__file__), '..', 'corpus', 'txt')
-        self.pdf_dir = os.path.join(os.path.dirname(__file__), '..', 'corpus', 'pdf')
-        self.ref_dir = os.path.join(os.path.dirname(__file__), '..', 'corpus', 'references')
+        self.txt_dir = TXT_DIR
+        self.pdf_dir = PDF_DIR
+        self.ref_dir = REF_DIR
         os.makedirs(self.txt_dir, exist_ok=True)
         os.makedirs(self.pdf_dir, exist_ok=True)
         os.makedirs(self.ref_dir, exist_ok=True)
     
+    def _eutils_params(self, params: Dict) -> Dict:
+        """Add the NCBI API key to an E-utilities request when one is configured."""
+        if self.api_key:
+            params['api_key'] = self.api_key
+        return params
+    
     def _rate_limit(self):
-        """Ensure we don't exceed 3 requests per second as per PubMed guidelines."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        
-        if time_since_last < self.rate_limit_delay:
-            sleep_time = self.rate_limit_delay - time_since_last
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
+        """Ensure we don't exceed the NCBI request rate (3 per second, or 10 with an API key)."""
+        with self._rate_limit_lock:
+            current_time = time.monotonic()
+            time_since_last = current_time - self.last_request_time
+            
+            if time_since_last < self.rate_limit_delay:
+                sleep_time = self.rate_limit_delay - time_since_last
+                time.sleep(sleep_time)
+            
+            self.last_request_time = time.monotonic()
     
-    def download_fulltext(self, pmid: str, filename: str) -> bool:
+    def download_fulltext(self, pmid: str, filename: str, pmc_id: Optional[str] = None) -> bool:
         """
         Attempt to download full text for a given PMID.
+        pmc_id may be passed when already resolved to skip the elink lookup.
         Returns True if successful, False otherwise.
         """
         try:
             # Check if PMC ID is available for this PMID
-            pmc_id = self._get_pmc_id(pmid)
+            pmc_id = pmc_id or self._get_pmc_id(pmid)
             if not pmc_id:
                 logger.info(f"No PMC ID found for PMID {pmid}")
                 return False
@@ -64,29 +98,25 @@ class ContentDownloader:
             logger.error(f"Error downloading full text for PMID {pmid}: {str(e)}")
             return False
     
-    def download_pdf(self, pmid: str, filename: str) -> bool:
+    def download_pdf(self, pmid: str, filename: str, pmc_id: Optional[str] = None) -> bool:
         """
         Attempt to download PDF for a given PMID.
+        pmc_id may be passed when already resolved to skip the elink lookup.
         Returns True if successful, False otherwise.
         """
         try:
             # Check if PMC ID is available for this PMID
-            pmc_id = self._get_pmc_id(pmid)
+            pmc_id = pmc_id or self._get_pmc_id(pmid)
             if not pmc_id:
                 logger.info(f"No PMC ID found for PMID {pmid}")
                 return False
             
-            # Try to download PDF from PMC
-            pdf_content = self._download_pmc_pdf(pmc_id)
-            if not pdf_content:
+            # Try to download PDF from PMC, streaming it straight to the file
+            pdf_path = os.path.join(self.pdf_dir, f"{filename}.pdf")
+            if not self._stream_pmc_pdf_to(pmc_id, pdf_path):
                 logger.info(f"Could not download PDF for PMC {pmc_id}")
                 return False
             
-            # Save to file
-            pdf_path = os.path.join(self.pdf_dir, f"{filename}.pdf")
-            with open(pdf_path, 'wb') as f:
-                f.write(pdf_content)
-            
             logger.info(f"Successfully downloaded PDF for PMID {pmid} to {pdf_path}")
             return True
             
@@ -94,14 +124,15 @@ class ContentDownloader:
             logger.error(f"Error downloading PDF for PMID {pmid}: {str(e)}")
             return False
     
-    def download_references(self, pmid: str, filename: str) -> bool:
+    def download_references(self, pmid: str, filename: str, pmc_id: Optional[str] = None) -> bool:
         """
         Attempt to download references for a given PMID.
+        pmc_id may be passed when already resolved to skip the elink lookup.
         Returns True if successful, False otherwise.
         """
         try:
             # Check if PMC ID is available for this PMID
-            pmc_id = self._get_pmc_id(pmid)
+            pmc_id = pmc_id or self._get_pmc_id(pmid)
             if not pmc_id:
                 logger.info(f"No PMC ID found for PMID {pmid}")
                 return False
@@ -128,6 +159,10 @@ class ContentDownloader:
         """
         Get PMC ID for a given PMID using elink.
         """
+        cached = self.pmc_id_cache.get(str(pmid))
+        if cached is not None:
+            return cached or None
+        
         self._rate_limit()
         
         link_url = f"{self.base_url}elink.fcgi"
@@ -139,31 +174,85 @@ class ContentDownloader:
         }
         
         try:
-            response = requests.get(link_url, params=params, timeout=30)
+            response = self.session.get(link_url, params=self._eutils_params(params), timeout=30)
             response.raise_for_status()
             
             # Parse XML response
-            root = ET.fromstring(response.content)
+            root = ET.fromstring(response.content, parser=_XML_PARSER)
             
             # Look for PMC links
             for link_set in root.findall('.//LinkSet'):
-                for link_set_db in link_set.findall('LinkSetDb'):
-                    db_to = link_set_db.find('DbTo')
-                    if db_to is not None and db_to.text == 'pmc':
-                        for link in link_set_db.findall('Link/Id'):
-                            pmc_id = link.text
-                            logger.info(f"Found PMC ID {pmc_id} for PMID {pmid}")
-                            return pmc_id
+                pmc_id = self._find_pmc_link(link_set)
+                if pmc_id:
+                    logger.info(f"Found PMC ID {pmc_id} for PMID {pmid}")
+                    self.pmc_id_cache.set(str(pmid), pmc_id)
+                    return pmc_id
             
+            self.pmc_id_cache.set(str(pmid), '')
             return None
             
         except requests.RequestException as e:
             logger.error(f"Request error getting PMC ID for PMID {pmid}: {str(e)}")
             return None
-        except ET.ParseError as e:
+        except ET.XMLSyntaxError as e:
             logger.error(f"XML parsing error getting PMC ID for PMID {pmid}: {str(e)}")
             return None
     
+    def get_pmc_ids_batch(self, pmids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Get PMC IDs for many PMIDs with one elink request per batch.
+        Returns a dictionary mapping each resolved PMID to its PMC ID, or None if it has none.
+        PMIDs missing from the result could not be looked up and should be retried individually.
+        """
+        pmc_ids = {}
+        uncached = []
+        for pmid in dict.fromkeys(str(pmid) for pmid in pmids if pmid):
+            cached = self.pmc_id_cache.get(pmid)
+            if cached is not None:
+                pmc_ids[pmid] = cached or None
+            else:
+                uncached.append(pmid)
+        
+        link_url = f"{self.base_url}elink.fcgi"
+        
+        for start in range(0, len(uncached), self.elink_batch_size):
+            batch = uncached[start:start + self.elink_batch_size]
+            # Repeated id parameters give one LinkSet per PMID; a comma-joined id merges them
+            params = {
+                'dbfrom': 'pubmed',
+                'db': 'pmc',
+                'id': batch,
+                'retmode': 'xml'
+            }
+            
+            self._rate_limit()
+            try:
+                # POST keeps long id lists out of the URL
+                response = self.session.post(link_url, data=self._eutils_params(params), timeout=60)
+                response.raise_for_status()
+                root = ET.fromstring(response.content, parser=_XML_PARSER)
+                
+                for link_set in root.findall('LinkSet'):
+                    source_id = link_set.find('IdList/Id')
+                    if source_id is not None and source_id.text:
+                        pmc_id = self._find_pmc_link(link_set)
+                        pmc_ids[source_id.text] = pmc_id
+                        self.pmc_id_cache.set(source_id.text, pmc_id or '')
+                        
+            except requests.RequestException as e:
+                logger.error(f"Request error getting PMC IDs for {len(batch)} PMIDs: {str(e)}")
+            except ET.XMLSyntaxError as e:
+                logger.error(f"XML parsing error getting PMC IDs for {len(batch)} PMIDs: {str(e)}")
+        
+        logger.info(f"Found PMC IDs for {sum(1 for pmc_id in pmc_ids.values() if pmc_id)} of {len(pmc_ids)} PMIDs")
+        return pmc_ids
+    
+    def _find_pmc_link(self, link_set) -> Optional[str]:
+        """Return the first PMC ID linked from an elink LinkSet element, if any."""
+        pmc_ids = _PMC_LINK_XPATH(link_set)
+        # Copy to a plain str so the result does not keep the parsed tree alive
+        return str(pmc_ids[0]) if pmc_ids else None
+    
     def _download_pmc_fulltext(self, pmc_id: str) -> Optional[str]:
         """
         Download full text content from PMC.
@@ -179,34 +268,60 @@ class ContentDownloader:
         }
         
         try:
-            response = requests.get(fetch_url, params=params, timeout=60)
+            response = self.session.get(fetch_url, params=self._eutils_params(params), timeout=60)
             response.raise_for_status()
             
-            # Parse XML and extract text content
-            root = ET.fromstring(response.content)
+            # Parse XML in a single streaming pass, extracting text as elements complete
+            title = None
+            abstract_parts = []
+            section_parts = []  # Filled in document order, so parent sections precede nested ones
+            open_sections = []  # Indexes into section_parts for the <sec> elements being parsed
+            body_depth = 0
+            text_length = 0  # Running length of the extracted parts, excluding separators
+            
+            for event, elem in ET.iterparse(io.BytesIO(response.content), events=('start', 'end'), huge_tree=True, recover=True):
+                if event == 'start':
+                    if elem.tag == 'body':
+                        body_depth += 1
+                    elif elem.tag == 'sec' and body_depth:
+                        open_sections.append(len(section_parts))
+                        section_parts.append(None)
+                    continue
+                
+                if elem.tag == 'article-title' and title is None:
+                    title = elem.text or ''
+                elif elem.tag == 'abstract':
+                    abstract_text = self._extract_text_from_element(elem)
+                    if abstract_text:
+                        abstract_parts.append(f"ABSTRACT: {abstract_text}")
+                        text_length += len(abstract_parts[-1])
+                    elem.clear()
+                elif elem.tag == 'sec' and open_sections:
+                    index = open_sections.pop()
+                    sec_text = self._extract_text_from_element(elem)
+                    if sec_text:
+                        # Get section title if available
+                        title_elem = elem.find('title')
+                        section_title = (title_elem.text if title_elem is not None else None) or "SECTION"
+                        section_parts[index] = f"{section_title.upper()}: {sec_text}"
+                        text_length += len(section_parts[index])
+                    # Nested sections are still needed for their parent's text
+                    if not open_sections:
+                        elem.clear()
+                elif elem.tag == 'body':
+                    body_depth -= 1
             
             # Extract text from various elements
             text_parts = []
-            
-            # Title
-            title_elem = root.find('.//article-title')
-            if title_elem is not None:
-                text_parts.append(f"TITLE: {title_elem.text or ''}")
-            
-            # Abstract
-            for abstract in root.findall('.//abstract'):
-                abstract_text = self._extract_text_from_element(abstract)
-                if abstract_text:
-                    text_parts.append(f"ABSTRACT: {abstract_text}")
-            
-            # Body sections
-            for sec in root.findall('.//body//sec'):
-                sec_text = self._extract_text_from_element(sec)
-                if sec_text:
-                    # Get section title if available
-                    title_elem = sec.find('title')
-                    section_title = title_elem.text if title_elem is not None else "SECTION"
-                    text_parts.append(f"{section_title.upper()}: {sec_text}")
+            if title is not None:
+                text_parts.append(f"TITLE: {title}")
+                text_length += len(text_parts[0])
+            text_parts.extend(abstract_parts)
+            text_parts.extend(part for part in section_parts if part)
+            
+            # Reject short documents before allocating the combined string
+            if text_length + 2 * max(len(text_parts) - 1, 0) < 100:
+                return None
             
             # Combine all text parts
             full_text = '\n\n'.join(text_parts)
@@ -219,48 +334,65 @@ class ContentDownloader:
         except requests.RequestException as e:
             logger.error(f"Request error downloading full text for PMC {pmc_id}: {str(e)}")
             return None
-        except ET.ParseError as e:
+        except ET.XMLSyntaxError as e:
             logger.error(f"XML parsing error for PMC {pmc_id}: {str(e)}")
             return None
         except Exception as e:
             logger.error(f"Unexpected error downloading full text for PMC {pmc_id}: {str(e)}")
             return None
     
-    def _download_pmc_pdf(self, pmc_id: str) -> Optional[bytes]:
+    def _stream_pmc_pdf_to(self, pmc_id: str, pdf_path: str) -> bool:
         """
-        Attempt to download PDF from PMC.
+        Attempt to download PDF from PMC directly into pdf_path.
         Note: PDF availability is limited and may require special access.
+        Returns True if a PDF was written, False otherwise.
         """
-        self._rate_limit()
-        
-        # PMC PDF URLs typically follow this pattern
-        pdf_url = f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/pdf/"
+        # PMC PDF URLs typically follow one of these patterns
+        pdf_urls = [
+            f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/pdf/",
+            f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/pdf/main.pdf"
+        ]
+        partial_path = f"{pdf_path}.part"
         
         try:
-            response = requests.get(pdf_url, timeout=60, stream=True)
-            
-            # Check if we got a PDF
-            content_type = response.headers.get('content-type', '').lower()
-            if 'pdf' in content_type and response.status_code == 200:
-                return response.content
-            else:
-                # Try alternative URL pattern
-                alt_pdf_url = f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/pdf/main.pdf"
-                alt_response = requests.get(alt_pdf_url, timeout=60)
-                
-                if alt_response.status_code == 200:
-                    alt_content_type = alt_response.headers.get('content-type', '').lower()
-                    if 'pdf' in alt_content_type:
-                        return alt_response.content
+            for pdf_url in pdf_urls:
+                try:
+                    # Probe with HEAD so a non-PDF page is rejected without opening a body
+                    # that would have to be discarded along with its connection. Each request
+                    # counts against the NCBI rate limit, so every one waits its turn
+                    self._rate_limit()
+                    probe = self.session.head(pdf_url, timeout=15, allow_redirects=True)
+                    probe_type = probe.headers.get('content-type', '').lower()
+                    if probe.status_code not in (405, 501) and (probe.status_code != 200 or 'pdf' not in probe_type):
+                        continue
+                    
+                    # Servers without HEAD support fall through to the streamed check below
+                    self._rate_limit()
+                    with self.session.get(pdf_url, timeout=60, stream=True) as response:
+                        # Check if we got a PDF before reading the body
+                        content_type = response.headers.get('content-type', '').lower()
+                        if response.status_code != 200 or 'pdf' not in content_type:
+                            continue
+                        
+                        # Write to a temporary file so a failed transfer never leaves a truncated PDF.
+                        # Large chunks keep a typical PDF to a handful of write calls.
+                        with open(partial_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                                f.write(chunk)
+                        os.replace(partial_path, pdf_path)
+                        return True
+                except requests.RequestException as e:
+                    # Retries exhausted or the transfer broke; the next candidate URL may still work
+                    logger.warning(f"Request error downloading PDF for PMC {pmc_id} from {pdf_url}: {str(e)}")
             
-            return None
+            return False
             
-        except requests.RequestException as e:
-            logger.error(f"Request error downloading PDF for PMC {pmc_id}: {str(e)}")
-            return None
         except Exception as e:
             logger.error(f"Unexpected error downloading PDF for PMC {pmc_id}: {str(e)}")
-            return None
+            return False
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
     
     def _download_pmc_references(self, pmc_id: str) -> Optional[str]:
         """
@@ -277,11 +409,11 @@ class ContentDownloader:
         }
         
         try:
-            response = requests.get(fetch_url, params=params, timeout=60)
+            response = self.session.get(fetch_url, params=self._eutils_params(params), timeout=60)
             response.raise_for_status()
             
             # Parse XML and extract references
-            root = ET.fromstring(response.content)
+            root = ET.fromstring(response.content, parser=_XML_PARSER)
             
             # Find reference list
             ref_list = root.find('.//ref-list')
@@ -309,7 +441,7 @@ class ContentDownloader:
         except requests.RequestException as e:
             logger.error(f"Request error downloading references for PMC {pmc_id}: {str(e)}")
             return None
-        except ET.ParseError as e:
+        except ET.XMLSyntaxError as e:
             logger.error(f"XML parsing error for PMC {pmc_id}: {str(e)}")
             return None
         except Exception as e:
@@ -329,7 +461,9 @@ class ContentDownloader:
                 ref_parts.append(f"[{ref_id}]")
             
             # Look for mixed-citation or element-citation
-            citation = ref_element.find('.//mixed-citation') or ref_element.find('.//element-citation')
+            citation = ref_element.find('.//mixed-citation')
+            if citation is None:
+                citation = ref_element.find('.//element-citation')
             
             if citation is not None:
                 # Extract text content while preserving structure
@@ -350,18 +484,7 @@ class ContentDownloader:
     
     def _extract_text_from_element(self, element) -> str:
         """
-        Recursively extract text content from an XML element.
+        Extract all text content from an XML element and its descendants.
         """
-        text_parts = []
-        
-        if element.text:
-            text_parts.append(element.text)
-        
-        for child in element:
-            child_text = self._extract_text_from_element(child)
-            if child_text:
-                text_parts.append(child_text)
-            if child.tail:
-                text_parts.append(child.tail)
-        
-        return ' '.join(text_parts).strip()
\ No newline at end of file
+        # itertext walks text and tails in document order without Python-level recursion
+        return ' '.join(text for text in element.itertext() if text.strip()).strip()
\ No newline at end of file
@@ -0,0 +1,7 @@
+import os
+
+# Corpus directories, resolved once relative to the project root rather than the working directory
+CORPUS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'corpus'))
+TXT_DIR = os.path.join(CORPUS_DIR, 'txt')
+PDF_DIR = os.path.join(CORPUS_DIR, 'pdf')
+REF_DIR = os.path.join(CORPUS_DIR, 'references')
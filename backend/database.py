@@ -1,12 +1,145 @@
 import pandas as pd
+import numpy as np
 import os
+import re
+import shutil
 from typing import List, Dict, Optional
 import logging
+import threading
+import time
+import functools
+from collections import OrderedDict
 import uuid
 from datetime import datetime
+from corpus_paths import TXT_DIR, PDF_DIR
 
 logger = logging.getLogger(__name__)
 
+def _normalize_pmid(pmid) -> Optional[str]:
+    """Normalize a PMID that may have been stored as a float (e.g. "38416429.0")."""
+    try:
+        return str(int(float(pmid)))
+    except (TypeError, ValueError):
+        return None
+
+def _by_int_pmid(values: Dict) -> Dict[int, object]:
+    """Re-key a PMID -> value mapping by integer PMID, matching the stored pmid column; invalid PMIDs are dropped."""
+    keyed = ((_normalize_pmid(pmid), value) for pmid, value in values.items())
+    return {int(pmid): value for pmid, value in keyed if pmid is not None}
+
+def _coerce_entries(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Give columns the types in _ENTRY_DTYPES, so written frames match a fresh parse:
+    PMIDs and availability flags get their nullable types and text columns hold
+    strings (e.g. a year of 2020 becomes "2020"), with missing values left missing.
+    """
+    typed = {'pmid': pd.to_numeric(df['pmid'], errors='coerce').astype('Int64')}
+    for col, dtype in _ENTRY_DTYPES.items():
+        if col == 'pmid' or col not in df.columns:
+            continue
+        if dtype == 'boolean':
+            typed[col] = df[col].astype('boolean')
+        else:
+            typed[col] = df[col].map(str, na_action='ignore')
+    return df.assign(**typed)
+
+def _to_records(df: pd.DataFrame) -> List[Dict]:
+    """Convert a frame to a list of row dicts, with NaN/NA replaced by None for JSON serialization."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def _row_to_dict(df: pd.DataFrame, position: int) -> Dict:
+    """Convert the row at a position to a dict with NaN/NA replaced by None; cheaper than _to_records for one row."""
+    return {key: (None if pd.isna(value) else value) for key, value in df.iloc[position].to_dict().items()}
+
+def _write_csv_atomic(df: pd.DataFrame, path: str):
+    """
+    Write a frame to a CSV file through a temporary file and os.replace, so readers
+    never see a partially written file and a failed write leaves the old file intact.
+    """
+    # Per-thread temporary name, so concurrent writers never share a temporary file
+    tmp_file = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+def _with_entries_lock(method):
+    """Run a method that reads and rewrites entries.csv while holding the entries lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._entries_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _with_jobs_lock(method):
+    """Run a method that reads and rewrites jobs.csv while holding the jobs lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._jobs_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# An author surname following a reference number, e.g. "24 Smith"
+_NUMBERED_AUTHOR_RE = re.compile(r'\d+\s+([A-Z][a-z]+)')
+
+# Job statuses that are written to jobs.csv immediately instead of with the next flush
+_FINAL_JOB_STATUSES = frozenset({'completed', 'failed', 'cancelled'})
+
+# Job columns changed by update_job_status, carried over when jobs.csv is re-read before a flush
+_JOB_PROGRESS_COLUMNS = ['status', 'total_refs', 'completed_refs', 'failed_refs', 'updated_at']
+
+# Job IDs that are safe to use as a file name inside the job results directory
+_JOB_ID_RE = re.compile(r'[\w-]+')
+
+# Column types for parsing the CSV tables. Declaring them skips pandas' type inference,
+# keeps identifiers such as PMIDs, PMC IDs and years from being read as floats ("2020.0")
+# and keeps the availability flags as nullable booleans rather than mixed objects
+_ENTRY_DTYPES = {
+    'pmid': 'Int64',
+    'filename': str,
+    'extraction_status': str,
+    'txt_available': 'boolean',
+    'pdf_available': 'boolean',
+    'ref_available': 'boolean',
+    'original_reference': str,
+    'extracted_title': str,
+    'found_title': str,
+    'first_author': str,
+    'journal': str,
+    'year': str,
+    'doi': str,
+    'created_at': str,
+    'pmc_id': str,
+    'pmc_lookup_at': str
+}
+
+_JOB_DTYPES = {
+    'job_id': str,
+    'status': str,
+    'total_refs': 'Int64',
+    'completed_refs': 'Int64',
+    'failed_refs': 'Int64',
+    'created_at': str,
+    'updated_at': str,
+    'references_text': str
+}
+
+_JOB_RESULT_DTYPES = {
+    'job_id': str,
+    'reference_index': 'Int64',
+    'status': str,
+    'pmid': 'Int64',
+    'extracted_title': str,
+    'error_message': str,
+    'processed_at': str
+}
+
 class DatabaseManager:
     def __init__(self, csv_file: str = None):
         if csv_file is None:
@@ -15,11 +148,38 @@ class DatabaseManager:
             csv_file = os.path.join(project_root, 'entries.csv')
         
         self.csv_file = csv_file
+        # Serializes read-modify-write cycles on entries.csv between request and job threads
+        self._entries_lock = threading.RLock()
+        # Parsed entries and the file modification time they were read at
+        self._entries_df = None
+        self._entries_mtime = None
+        # Rows appended to the file since the frame was built, folded in on the next read
+        self._pending_entries = []
+        # Query results computed from the current entries frame, dropped when it changes
+        self._results_df = None
+        self._results = OrderedDict()
+        self.max_cached_results = 128
+        
+        # Normalized PMIDs already stored, loaded lazily so duplicate checks skip the CSV read
+        self._known_pmids = None
+        self._known_pmids_lock = threading.RLock()
         
         # Job system CSV files
         project_root = os.path.dirname(os.path.dirname(__file__))
         self.jobs_csv = os.path.join(project_root, 'jobs.csv')
+        # Results of jobs run before results were kept in one file per job
         self.job_results_csv = os.path.join(project_root, 'job_results.csv')
+        self.job_results_dir = os.path.join(project_root, 'job_results')
+        # Serializes read-modify-write cycles on the job tables between concurrent jobs
+        self._jobs_lock = threading.RLock()
+        # Parsed jobs and the file modification time they were read at
+        self._jobs_df = None
+        self._jobs_mtime = None
+        # Progress updates are kept in the cached jobs and written at most once per interval (seconds)
+        self.jobs_flush_interval = 1.0
+        # IDs of jobs whose updates are only in the cached frame so far
+        self._dirty_job_ids = set()
+        self._jobs_flushed_at = 0.0
         self.columns = [
             'pmid',
             'filename',
@@ -34,49 +194,216 @@ class DatabaseManager:
             'journal',
             'year',
             'doi',
-            'created_at'
+            'created_at',
+            'pmc_id',  # PMC ID from the last elink lookup, empty if the article is not in PMC
+            'pmc_lookup_at'  # When pmc_id was last looked up, empty if never
         ]
         
         # Initialize CSV file if it doesn't exist
         self._initialize_csv()
+        # Split legacy job results before any job thread can append to the directory
+        self._init_job_results_dir()
     
     def _initialize_csv(self):
         """Create CSV file with headers if it doesn't exist."""
         if not os.path.exists(self.csv_file):
             df = pd.DataFrame(columns=self.columns)
-            df.to_csv(self.csv_file, index=False)
+            self._write_entries(df)
             logger.info(f"Created new CSV database at {self.csv_file}")
     
+    def _read_entries(self, copy: bool = True) -> pd.DataFrame:
+        """
+        Return all entries, parsing the CSV only when it has changed on disk.
+        Columns are parsed with the types in _ENTRY_DTYPES. PMIDs are nullable integers,
+        so rows can be matched on one numeric column whether the file stores them as
+        "38416429" or "38416429.0".
+        Pass copy=False only from methods that do not modify the returned frame.
+        """
+        # Under the lock, so a read cannot land between an append and its queuing
+        with self._entries_lock:
+            self._load_entries()
+            if self._pending_entries:
+                self._entries_df = pd.concat([self._entries_df, *self._pending_entries], ignore_index=True)
+                self._pending_entries = []
+            df = self._entries_df
+        return df.copy() if copy else df
+    
+    @_with_entries_lock
+    def _load_entries(self):
+        """Parse the CSV into the cached frame if it has changed on disk since it was read."""
+        mtime = os.stat(self.csv_file).st_mtime_ns
+        if self._entries_df is None or mtime != self._entries_mtime:
+            self._entries_df = pd.read_csv(self.csv_file, dtype=_ENTRY_DTYPES, memory_map=True)
+            self._entries_mtime = mtime
+            self._pending_entries = []
+            # The file changed outside this manager, so the known PMIDs may be stale
+            self._reset_known_pmids()
+    
+    def _append_entries(self, new_df: pd.DataFrame):
+        """
+        Append new entries to the CSV database without rewriting the existing rows.
+        The appended rows are queued rather than concatenated onto the cached frame,
+        so a run of appends with no reads in between costs a single concat.
+        Falls back to a full write when the file's columns differ from the current schema.
+        """
+        self._load_entries()
+        if list(self._entries_df.columns) != self.columns:
+            # Rewriting also upgrades the header of files created before newer columns
+            df = self._read_entries(copy=False)
+            self._write_entries(pd.concat([df, new_df], ignore_index=True))
+            return
+        
+        new_df = _coerce_entries(new_df[self.columns])
+        new_df.to_csv(self.csv_file, mode='a', header=False, index=False)
+        
+        self._pending_entries.append(new_df)
+        self._entries_mtime = os.stat(self.csv_file).st_mtime_ns
+    
+    def _memoized(self, key, df: pd.DataFrame, compute):
+        """
+        Return compute() for the given entries frame, reusing an earlier result for the
+        same key until the frame is replaced by a write or a re-read.
+        Past max_cached_results the least recently used result is dropped, so a stream of
+        distinct search queries does not evict the shared search text, flags or PMID index.
+        """
+        with self._entries_lock:
+            if self._results_df is not df:
+                self._results_df = df
+                self._results = OrderedDict()
+            # Lookup and recency update together, so the key cannot be evicted in between
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        
+        # Computed outside the lock, so a slow query does not hold up writers
+        result = compute()
+        with self._entries_lock:
+            # Only publish if no write or re-read replaced the frame in the meantime
+            if self._results_df is df:
+                self._results[key] = result
+                while len(self._results) > self.max_cached_results:
+                    self._results.popitem(last=False)
+        return result
+    
+    def _status_flags(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Return boolean arrays for the extraction status and file availability of each row,
+        computed once per entries frame and shared by the statistics and failed-entry queries.
+        """
+        # Compare the raw column arrays directly, skipping pandas' Series machinery;
+        # the flags are nullable booleans, so missing values count as False
+        return self._memoized(('status_flags',), df, lambda: {
+            'success': np.asarray(df['extraction_status'].to_numpy() == 'success', dtype=bool),
+            'txt_available': df['txt_available'].to_numpy(dtype=bool, na_value=False),
+            'pdf_available': df['pdf_available'].to_numpy(dtype=bool, na_value=False)
+        })
+    
+    def _pmid_positions(self, df: pd.DataFrame) -> Dict[int, int]:
+        """
+        Return a map from each PMID to the position of its first row, built once per
+        entries frame, so single-entry lookups skip scanning the PMID column.
+        """
+        def build():
+            pmids = df['pmid']
+            present = pmids.notna().to_numpy()
+            positions = pd.Series(np.flatnonzero(present), index=pmids[present].astype('int64'))
+            positions = positions[~positions.index.duplicated()]
+            return dict(zip(positions.index.tolist(), positions.tolist()))
+        
+        return self._memoized(('pmid_positions',), df, build)
+    
+    def _pmid_mask(self, df: pd.DataFrame, pmid) -> pd.Series:
+        """Return a boolean mask of the rows whose PMID equals pmid."""
+        pmid = _normalize_pmid(pmid)
+        if pmid is None:
+            return pd.Series(False, index=df.index)
+        return (df['pmid'] == int(pmid)).fillna(False).astype(bool)
+    
+    def _write_entries(self, df: pd.DataFrame):
+        """
+        Write all entries to the CSV database.
+        The file is replaced atomically, so readers never see a partially written
+        file and a failed write loses nothing.
+        """
+        # Keep columns typed as on read, so the cached frame matches a fresh parse
+        df = _coerce_entries(df)
+        
+        _write_csv_atomic(df, self.csv_file)
+        
+        # The written frame becomes the cache, so the next read skips parsing
+        self._entries_df = df
+        self._entries_mtime = os.stat(self.csv_file).st_mtime_ns
+        self._pending_entries = []
+    
+    def _find_known_pmids(self, pmids: set) -> set:
+        """
+        Return the subset of normalized PMIDs that are already stored.
+        The PMID set is built from the entries frame on first use, kept up to date
+        on writes, and rebuilt after entries.csv changes on disk.
+        """
+        # Entries lock first, matching writers that update the known set while holding it
+        with self._entries_lock, self._known_pmids_lock:
+            # Only check the file for outside changes here; folding queued appends into
+            # the frame is left to the next real read, since the set already has them
+            self._load_entries()
+            if self._known_pmids is None:
+                df = self._read_entries(copy=False)
+                self._known_pmids = set(map(str, df['pmid'].dropna().tolist()))
+            return pmids & self._known_pmids
+    
+    def _remember_pmids(self, pmids: List) -> None:
+        """Add newly written PMIDs to the known set if it has been loaded."""
+        with self._known_pmids_lock:
+            if self._known_pmids is not None:
+                self._known_pmids.update(p for p in map(_normalize_pmid, pmids) if p)
+    
+    def _forget_pmids(self, pmids: List) -> None:
+        """Remove deleted PMIDs from the known set if it has been loaded."""
+        with self._known_pmids_lock:
+            if self._known_pmids is not None:
+                self._known_pmids.difference_update(p for p in map(_normalize_pmid, pmids) if p)
+    
+    def _reset_known_pmids(self) -> None:
+        """Drop the known PMID set so it is reloaded after rows are removed."""
+        with self._known_pmids_lock:
+            self._known_pmids = None
+    
     def add_entry(self, entry_data: Dict) -> bool:
         """
         Add a new entry to the database.
         Returns True if successful, False otherwise.
         """
+        # A single entry is a batch of one, always stamped with the current time
+        return self.add_entries([{**entry_data, 'created_at': datetime.now().isoformat()}])
+    
+    @_with_entries_lock
+    def add_entries(self, entries: List[Dict]) -> bool:
+        """
+        Add multiple entries to the database with a single append.
+        Entries may carry their own created_at timestamp; otherwise the current time is used.
+        Returns True if successful, False otherwise.
+        """
+        if not entries:
+            return True
+        
         try:
-            # Read existing data
-            df = pd.read_csv(self.csv_file)
-            
             # Prepare entry data with all columns
-            new_entry = {}
-            for col in self.columns:
-                if col == 'created_at':
-                    import datetime
-                    new_entry[col] = datetime.datetime.now().isoformat()
-                else:
-                    new_entry[col] = entry_data.get(col, None)
-            
-            # Add the new entry
-            new_df = pd.DataFrame([new_entry])
-            df = pd.concat([df, new_df], ignore_index=True)
-            
-            # Save back to CSV
-            df.to_csv(self.csv_file, index=False)
-            
-            logger.info(f"Added entry for PMID: {entry_data.get('pmid', 'Unknown')}")
+            new_entries = []
+            for entry_data in entries:
+                new_entry = {col: entry_data.get(col, None) for col in self.columns}
+                if not new_entry['created_at']:
+                    new_entry['created_at'] = datetime.now().isoformat()
+                new_entries.append(new_entry)
+            
+            # Append the new entries to the CSV
+            self._append_entries(pd.DataFrame(new_entries, columns=self.columns))
+            self._remember_pmids([entry['pmid'] for entry in new_entries])
+            
+            logger.info(f"Added {len(new_entries)} entries")
             return True
             
         except Exception as e:
-            logger.error(f"Error adding entry to database: {str(e)}")
+            logger.error(f"Error adding entries to database: {str(e)}")
             return False
     
     def pmid_exists(self, pmid: str) -> bool:
@@ -85,69 +412,75 @@ class DatabaseManager:
         Returns True if exists, False otherwise.
         """
         try:
+            pmid = _normalize_pmid(pmid)
             if not pmid:
                 return False
                 
-            df = pd.read_csv(self.csv_file)
-            return pmid in df['pmid'].astype(str).values
+            return bool(self._find_known_pmids({pmid}))
             
         except Exception as e:
             logger.error(f"Error checking PMID existence: {str(e)}")
             return False
     
+    def pmid_exists_many(self, pmids: List[str]) -> set:
+        """
+        Check many PMIDs against the database with a single read.
+        Returns the set of given PMIDs that already exist.
+        """
+        try:
+            pmids = {p for p in map(_normalize_pmid, pmids) if p}
+            if not pmids:
+                return set()
+            
+            return self._find_known_pmids(pmids)
+            
+        except Exception as e:
+            logger.error(f"Error checking PMID existence: {str(e)}")
+            return set()
+    
     def get_entry_by_pmid(self, pmid: str) -> Optional[Dict]:
         """
         Get a specific entry by PMID.
         Returns dictionary with entry data or None if not found.
         """
         try:
-            df = pd.read_csv(self.csv_file)
-            # Handle both integer and float PMIDs
-            pmid_str = str(pmid)
-            pmid_float_str = f"{float(pmid)}"
+            normalized = _normalize_pmid(pmid)
+            if normalized is None:
+                return None
             
-            matching_rows = df[(df['pmid'].astype(str) == pmid_str) | 
-                              (df['pmid'].astype(str) == pmid_float_str)]
+            df = self._read_entries(copy=False)
+            position = self._pmid_positions(df).get(int(normalized))
             
-            if matching_rows.empty:
+            if position is None:
                 return None
             
             # Convert to dictionary and handle NaN values
-            entry = matching_rows.iloc[0].to_dict()
-            # Replace NaN with None for JSON serialization
-            for key, value in entry.items():
-                if pd.isna(value):
-                    entry[key] = None
-            
-            return entry
+            return _row_to_dict(df, position)
             
         except Exception as e:
             logger.error(f"Error retrieving entry by PMID {pmid}: {str(e)}")
             return None
     
+    @_with_entries_lock
     def delete_entry_by_pmid(self, pmid: str) -> bool:
         """
         Delete an entry by PMID.
         Returns True if successful, False otherwise.
         """
         try:
-            df = pd.read_csv(self.csv_file)
+            df = self._read_entries()
             initial_len = len(df)
             
-            # Handle both integer and float PMIDs
-            pmid_str = str(pmid)
-            pmid_float_str = f"{float(pmid)}"
-            
             # Remove matching rows
-            df = df[~((df['pmid'].astype(str) == pmid_str) | 
-                     (df['pmid'].astype(str) == pmid_float_str))]
+            df = df[~self._pmid_mask(df, pmid)]
             
             if len(df) == initial_len:
                 logger.warning(f"No entry found with PMID {pmid} to delete")
                 return False
             
             # Save updated dataframe
-            df.to_csv(self.csv_file, index=False)
+            self._write_entries(df)
+            self._forget_pmids([pmid])
             logger.info(f"Deleted entry with PMID {pmid}")
             return True
             
@@ -155,13 +488,14 @@ class DatabaseManager:
             logger.error(f"Error deleting entry by PMID {pmid}: {str(e)}")
             return False
     
+    @_with_entries_lock
     def delete_entry_by_timestamp(self, created_at: str) -> bool:
         """
         Delete an entry by its created_at timestamp.
         Returns True if successful, False otherwise.
         """
         try:
-            df = pd.read_csv(self.csv_file)
+            df = self._read_entries()
             initial_len = len(df)
             
             # Remove matching rows by created_at
@@ -172,7 +506,8 @@ class DatabaseManager:
                 return False
             
             # Save updated dataframe
-            df.to_csv(self.csv_file, index=False)
+            self._write_entries(df)
+            self._reset_known_pmids()
             logger.info(f"Deleted entry with created_at {created_at}")
             return True
             
@@ -180,57 +515,55 @@ class DatabaseManager:
             logger.error(f"Error deleting entry by created_at {created_at}: {str(e)}")
             return False
     
+    @_with_entries_lock
     def fix_filename_format(self) -> bool:
         """
         Fix filename format for entries that have numeric first_author values.
         Extract proper author names from original_reference.
         """
         try:
-            df = pd.read_csv(self.csv_file)
-            modified = False
-            
-            for index, row in df.iterrows():
-                # Check if first_author is numeric
-                first_author = str(row.get('first_author', ''))
-                if first_author.isdigit():
-                    # Extract author from original_reference
-                    original_ref = str(row.get('original_reference', ''))
-                    if original_ref and original_ref != 'nan':
-                        # Pattern to find author name after number
-                        import re
-                        match = re.search(r'\d+\s+([A-Z][a-z]+)', original_ref)
-                        if match:
-                            author_name = match.group(1)
-                            pmid = row.get('pmid')
-                            
-                            # Update first_author and filename
-                            df.at[index, 'first_author'] = author_name
-                            if pmid and not pd.isna(pmid):
-                                new_filename = f"{author_name}_{int(float(pmid))}"
-                                df.at[index, 'filename'] = new_filename
-                                
-                                # Rename actual files if they exist
-                                old_filename = row.get('filename', '')
-                                if old_filename:
-                                    old_txt = os.path.join('corpus', 'txt', f'{old_filename}.txt')
-                                    new_txt = os.path.join('corpus', 'txt', f'{new_filename}.txt')
-                                    old_pdf = os.path.join('corpus', 'pdf', f'{old_filename}.pdf')
-                                    new_pdf = os.path.join('corpus', 'pdf', f'{new_filename}.pdf')
-                                    
-                                    if os.path.exists(old_txt):
-                                        os.rename(old_txt, new_txt)
-                                        logger.info(f"Renamed {old_txt} to {new_txt}")
-                                    
-                                    if os.path.exists(old_pdf):
-                                        os.rename(old_pdf, new_pdf)
-                                        logger.info(f"Renamed {old_pdf} to {new_pdf}")
-                                
-                                modified = True
-                                logger.info(f"Fixed entry for PMID {pmid}: {first_author} -> {author_name}")
-            
-            if modified:
-                df.to_csv(self.csv_file, index=False)
-                logger.info("Fixed filename format for entries with numeric first_author")
+            df = self._read_entries()
+            
+            # Pull the author name after the reference number out of every entry whose
+            # first_author is numeric, in one vectorized pass per column
+            numeric_author = df['first_author'].fillna('').astype(str).str.isdigit()
+            authors = df.loc[numeric_author, 'original_reference'].str.extract(_NUMBERED_AUTHOR_RE, expand=False).dropna()
+            
+            # Only entries with a PMID can be given a new filename
+            renamed = authors[df.loc[authors.index, 'pmid'].notna()]
+            if renamed.empty:
+                return True
+            
+            old_authors = df.loc[renamed.index, 'first_author']
+            old_filenames = df.loc[renamed.index, 'filename']
+            pmids = df.loc[renamed.index, 'pmid'].astype(str)
+            new_filenames = renamed + '_' + pmids
+            
+            # Update first_author and filename
+            df.loc[authors.index, 'first_author'] = authors
+            df.loc[renamed.index, 'filename'] = new_filenames
+            
+            # Rename actual files if they exist
+            for pmid, first_author, author_name, old_filename, new_filename in zip(
+                    pmids, old_authors, renamed, old_filenames, new_filenames):
+                if isinstance(old_filename, str) and old_filename:
+                    old_txt = os.path.join(TXT_DIR, f'{old_filename}.txt')
+                    new_txt = os.path.join(TXT_DIR, f'{new_filename}.txt')
+                    old_pdf = os.path.join(PDF_DIR, f'{old_filename}.pdf')
+                    new_pdf = os.path.join(PDF_DIR, f'{new_filename}.pdf')
+                    
+                    if os.path.exists(old_txt):
+                        os.rename(old_txt, new_txt)
+                        logger.info(f"Renamed {old_txt} to {new_txt}")
+                    
+                    if os.path.exists(old_pdf):
+                        os.rename(old_pdf, new_pdf)
+                        logger.info(f"Renamed {old_pdf} to {new_pdf}")
+                
+                logger.info(f"Fixed entry for PMID {pmid}: {first_author} -> {author_name}")
+            
+            self._write_entries(df)
+            logger.info("Fixed filename format for entries with numeric first_author")
             
             return True
             
@@ -238,62 +571,54 @@ class DatabaseManager:
             logger.error(f"Error fixing filename format: {str(e)}")
             return False
     
+    @_with_entries_lock
     def get_entries_without_references(self) -> List[Dict]:
         """
         Get all entries that don't have references yet (ref_available is null or false).
         """
         try:
-            df = pd.read_csv(self.csv_file)
+            # Only read the cached frame; a copy is needed just for the one-off column upgrade
+            df = self._read_entries(copy=False)
             
             # Add ref_available column if it doesn't exist
             if 'ref_available' not in df.columns:
-                df['ref_available'] = False
-                df.to_csv(self.csv_file, index=False)
-            
-            # Filter entries without references and with valid PMIDs
-            entries_without_refs = df[
-                (df['ref_available'].isna() | (df['ref_available'] == False)) & 
-                (df['pmid'].notna()) & 
-                (df['extraction_status'] == 'success')
-            ]
-            
-            # Convert to list of dictionaries
-            entries = []
-            for _, row in entries_without_refs.iterrows():
-                entry = row.to_dict()
-                # Replace NaN with None for JSON serialization
-                for key, value in entry.items():
-                    if pd.isna(value):
-                        entry[key] = None
-                entries.append(entry)
+                df = df.assign(ref_available=False)
+                self._write_entries(df)
+            
+            def without_references():
+                # Filter entries without references and with valid PMIDs, converting only those rows
+                without_refs = (
+                    ~df['ref_available'].to_numpy(dtype=bool, na_value=False) &
+                    df['pmid'].notna().to_numpy() &
+                    self._status_flags(df)['success']
+                )
+                return _to_records(df.take(np.flatnonzero(without_refs)))
             
-            return entries
+            # Copy the cached rows so callers can't modify them
+            return [dict(entry) for entry in self._memoized(('without_references',), df, without_references)]
             
         except Exception as e:
             logger.error(f"Error getting entries without references: {str(e)}")
             return []
     
+    @_with_entries_lock
     def update_ref_availability(self, pmid: str, ref_available: bool) -> bool:
         """
         Update the ref_available status for a specific PMID.
         """
         try:
-            df = pd.read_csv(self.csv_file)
+            df = self._read_entries()
             
             # Add ref_available column if it doesn't exist
             if 'ref_available' not in df.columns:
                 df['ref_available'] = False
             
-            # Handle both integer and float PMIDs
-            pmid_str = str(pmid)
-            pmid_float_str = f"{float(pmid)}"
-            
             # Update matching rows
-            mask = (df['pmid'].astype(str) == pmid_str) | (df['pmid'].astype(str) == pmid_float_str)
+            mask = self._pmid_mask(df, pmid)
             df.loc[mask, 'ref_available'] = ref_available
             
             if mask.any():
-                df.to_csv(self.csv_file, index=False)
+                self._write_entries(df)
                 logger.info(f"Updated ref_available to {ref_available} for PMID {pmid}")
                 return True
             else:
@@ -304,37 +629,110 @@ class DatabaseManager:
             logger.error(f"Error updating ref_availability for PMID {pmid}: {str(e)}")
             return False
     
+    @_with_entries_lock
+    def update_ref_availability_bulk(self, ref_availability: Dict[str, bool]) -> int:
+        """
+        Update the ref_available status for many PMIDs with a single read and write.
+        Takes a dictionary mapping PMID to availability and returns the number of rows updated.
+        """
+        if not ref_availability:
+            return 0
+        
+        try:
+            df = self._read_entries()
+            
+            # Add ref_available column if it doesn't exist
+            if 'ref_available' not in df.columns:
+                df['ref_available'] = False
+            
+            # Match on the integer pmid column directly, without parsing each stored PMID
+            normalized = _by_int_pmid(ref_availability)
+            mask = df['pmid'].isin(normalized.keys()).fillna(False).astype(bool)
+            
+            if not mask.any():
+                logger.warning("No entries found to update ref_available")
+                return 0
+            
+            df.loc[mask, 'ref_available'] = df.loc[mask, 'pmid'].map(normalized)
+            self._write_entries(df)
+            
+            updated = int(mask.sum())
+            logger.info(f"Updated ref_available for {updated} entries")
+            return updated
+            
+        except Exception as e:
+            logger.error(f"Error updating ref_availability in bulk: {str(e)}")
+            return 0
+    
+    @_with_entries_lock
+    def update_pmc_ids_bulk(self, pmc_ids: Dict[str, Optional[str]]) -> int:
+        """
+        Record PMC ID lookups for many PMIDs with a single read and write.
+        Takes a dictionary mapping PMID to PMC ID (None when the article is not in PMC)
+        and stamps pmc_lookup_at so the lookup can be reused later.
+        Returns the number of rows updated.
+        """
+        if not pmc_ids:
+            return 0
+        
+        try:
+            df = self._read_entries()
+            
+            # Add the PMC columns to databases created before they existed
+            for col in ('pmc_id', 'pmc_lookup_at'):
+                if col not in df.columns:
+                    df[col] = None
+                df[col] = df[col].astype(object)
+            
+            normalized = _by_int_pmid(pmc_ids)
+            mask = df['pmid'].isin(normalized.keys()).fillna(False).astype(bool)
+            
+            if not mask.any():
+                return 0
+            
+            df.loc[mask, 'pmc_id'] = df.loc[mask, 'pmid'].map(normalized)
+            df.loc[mask, 'pmc_lookup_at'] = datetime.now().isoformat()
+            self._write_entries(df)
+            
+            updated = int(mask.sum())
+            logger.info(f"Updated PMC IDs for {updated} entries")
+            return updated
+            
+        except Exception as e:
+            logger.error(f"Error updating PMC IDs in bulk: {str(e)}")
+            return 0
+    
     def search_entries(self, search_query: str = '') -> List[Dict]:
         """
         Search entries by title, author, or PMID.
         Returns list of matching entries.
         """
         try:
-            df = pd.read_csv(self.csv_file)
+            df = self._read_entries(copy=False)
+            search_query = (search_query or '').lower()
             
-            if not search_query:
-                # Return all entries
-                matching_df = df
-            else:
-                # Search in multiple columns
-                search_query = search_query.lower()
-                mask = (
-                    df['extracted_title'].astype(str).str.lower().str.contains(search_query, na=False) |
-                    df['found_title'].astype(str).str.lower().str.contains(search_query, na=False) |
-                    df['first_author'].astype(str).str.lower().str.contains(search_query, na=False) |
-                    df['pmid'].astype(str).str.contains(search_query, na=False)
-                )
-                matching_df = df[mask]
-            
-            # Convert to list of dictionaries
-            entries = []
-            for _, row in matching_df.iterrows():
-                entry = row.to_dict()
-                # Replace NaN with None for JSON serialization
-                for key, value in entry.items():
-                    if pd.isna(value):
-                        entry[key] = None
-                entries.append(entry)
+            def search():
+                if not search_query:
+                    # Return all entries
+                    matching_df = df
+                else:
+                    # Search all columns in one literal (non-regex) pass over a combined,
+                    # lowercased text; the separator keeps matches from spanning columns.
+                    # The combined text is built once per frame and shared by all queries
+                    searchable = self._memoized(('search_text',), df, lambda: (
+                        df['extracted_title'].fillna('').astype(str) + '\x1f' +
+                        df['found_title'].fillna('').astype(str) + '\x1f' +
+                        df['first_author'].fillna('').astype(str) + '\x1f' +
+                        df['pmid'].astype('string').fillna('')
+                    ).str.lower())
+                    mask = searchable.str.contains(search_query, regex=False)
+                    matching_df = df[mask]
+                
+                # Convert to list of dictionaries
+                return _to_records(matching_df)
+            
+            # Copy the cached rows so callers can't modify them
+            entries = [dict(entry) for entry in self._memoized(('search', search_query), df, search)]
             
             logger.info(f"Found {len(entries)} entries for search query: '{search_query}'")
             return entries
@@ -349,21 +747,15 @@ class DatabaseManager:
         Returns list of failed entries.
         """
         try:
-            df = pd.read_csv(self.csv_file)
-            
-            # Filter for failed entries
-            failed_mask = df['extraction_status'] != 'success'
-            failed_df = df[failed_mask]
-            
-            # Convert to list of dictionaries
-            entries = []
-            for _, row in failed_df.iterrows():
-                entry = row.to_dict()
-                # Replace NaN with None for JSON serialization
-                for key, value in entry.items():
-                    if pd.isna(value):
-                        entry[key] = None
-                entries.append(entry)
+            df = self._read_entries(copy=False)
+            
+            def failed():
+                # Take only the failed rows by position, so just those rows are converted
+                failed_rows = np.flatnonzero(~self._status_flags(df)['success'])
+                return _to_records(df.take(failed_rows))
+            
+            # Copy the cached rows so callers can't modify them
+            entries = [dict(entry) for entry in self._memoized(('failed',), df, failed)]
             
             logger.info(f"Found {len(entries)} failed entries")
             return entries
@@ -379,14 +771,15 @@ class DatabaseManager:
         """
         return self.search_entries('')
     
+    @_with_entries_lock
     def update_entry(self, pmid: str, update_data: Dict) -> bool:
         """
         Update an existing entry by PMID.
         Returns True if successful, False otherwise.
         """
         try:
-            df = pd.read_csv(self.csv_file)
-            mask = df['pmid'].astype(str) == str(pmid)
+            df = self._read_entries()
+            mask = self._pmid_mask(df, pmid)
             
             if not mask.any():
                 logger.warning(f"No entry found with PMID {pmid} to update")
@@ -398,7 +791,9 @@ class DatabaseManager:
                     df.loc[mask, key] = value
             
             # Save back to CSV
-            df.to_csv(self.csv_file, index=False)
+            self._write_entries(df)
+            if 'pmid' in update_data:
+                self._reset_known_pmids()
             
             logger.info(f"Updated entry for PMID: {pmid}")
             return True
@@ -413,47 +808,55 @@ class DatabaseManager:
         Returns dictionary with various statistics.
         """
         try:
-            df = pd.read_csv(self.csv_file)
-            
-            stats = {
-                'total_entries': len(df),
-                'successful_extractions': len(df[df['extraction_status'] == 'success']),
-                'failed_extractions': len(df[df['extraction_status'] != 'success']),
-                'txt_available': len(df[df['txt_available'] == True]),
-                'pdf_available': len(df[df['pdf_available'] == True]),
-                'both_available': len(df[(df['txt_available'] == True) & (df['pdf_available'] == True)])
-            }
-            
-            # Success rate
-            if stats['total_entries'] > 0:
-                stats['success_rate'] = stats['successful_extractions'] / stats['total_entries']
-            else:
-                stats['success_rate'] = 0
+            df = self._read_entries(copy=False)
+            
+            def statistics():
+                # One count per flag array; failures are the complement of successes
+                flags = self._status_flags(df)
+                successful = int(np.count_nonzero(flags['success']))
+                stats = {
+                    'total_entries': len(df),
+                    'successful_extractions': successful,
+                    'failed_extractions': len(df) - successful,
+                    'txt_available': int(np.count_nonzero(flags['txt_available'])),
+                    'pdf_available': int(np.count_nonzero(flags['pdf_available'])),
+                    'both_available': int(np.count_nonzero(flags['txt_available'] & flags['pdf_available']))
+                }
+                
+                # Success rate
+                if stats['total_entries'] > 0:
+                    stats['success_rate'] = stats['successful_extractions'] / stats['total_entries']
+                else:
+                    stats['success_rate'] = 0
+                
+                return stats
             
-            return stats
+            return dict(self._memoized(('statistics',), df, statistics))
             
         except Exception as e:
             logger.error(f"Error getting statistics: {str(e)}")
             return {}
     
+    @_with_entries_lock
     def delete_entry(self, pmid: str) -> bool:
         """
         Delete an entry by PMID.
         Returns True if successful, False otherwise.
         """
         try:
-            df = pd.read_csv(self.csv_file)
+            df = self._read_entries()
             initial_count = len(df)
             
             # Remove entries with matching PMID
-            df = df[df['pmid'].astype(str) != str(pmid)]
+            df = df[~self._pmid_mask(df, pmid)]
             
             if len(df) == initial_count:
                 logger.warning(f"No entry found with PMID {pmid} to delete")
                 return False
             
             # Save back to CSV
-            df.to_csv(self.csv_file, index=False)
+            self._write_entries(df)
+            self._forget_pmids([pmid])
             
             logger.info(f"Deleted entry for PMID: {pmid}")
             return True
@@ -471,17 +874,100 @@ class DatabaseManager:
                 'job_id', 'status', 'total_refs', 'completed_refs', 'failed_refs', 
                 'created_at', 'updated_at', 'references_text'
             ])
-            jobs_df.to_csv(self.jobs_csv, index=False)
-    
-    def _init_job_results_csv(self):
-        """Initialize job_results.csv if it doesn't exist.""" 
-        if not os.path.exists(self.job_results_csv):
-            results_df = pd.DataFrame(columns=[
-                'job_id', 'reference_index', 'status', 'pmid', 'extracted_title', 
-                'error_message', 'processed_at'
-            ])
-            results_df.to_csv(self.job_results_csv, index=False)
+            _write_csv_atomic(jobs_df, self.jobs_csv)
+    
+    def _job_results_path(self, job_id: str) -> Optional[str]:
+        """Get the results file of a job, or None if the job ID can't name a file."""
+        if not isinstance(job_id, str) or not _JOB_ID_RE.fullmatch(job_id):
+            return None
+        return os.path.join(self.job_results_dir, f"{job_id}.csv")
+    
+    def _init_job_results_dir(self):
+        """
+        Create the job results directory, splitting the results of older jobs
+        out of job_results.csv into their own files the first time.
+        The split is written to a temporary directory that is renamed into place when
+        complete, so no job can append to a results file the split then replaces.
+        """
+        if os.path.isdir(self.job_results_dir):
+            return
+        
+        with self._jobs_lock:
+            if os.path.isdir(self.job_results_dir):
+                return
+            
+            tmp_dir = f"{self.job_results_dir}.{threading.get_ident()}.tmp"
+            os.makedirs(tmp_dir, exist_ok=True)
+            if os.path.exists(self.job_results_csv):
+                try:
+                    results_df = pd.read_csv(self.job_results_csv, dtype=_JOB_RESULT_DTYPES)
+                    results_df = results_df.reindex(columns=list(_JOB_RESULT_DTYPES))
+                    for job_id, job_results in results_df.groupby('job_id', sort=False):
+                        path = self._job_results_path(job_id)
+                        if path is not None:
+                            _write_csv_atomic(job_results, os.path.join(tmp_dir, os.path.basename(path)))
+                    logger.info(f"Split job_results.csv into {self.job_results_dir}")
+                except Exception as e:
+                    logger.error(f"Error splitting job_results.csv: {str(e)}")
+            
+            try:
+                os.rename(tmp_dir, self.job_results_dir)
+            except OSError:
+                # Another process created the directory first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    def _read_jobs(self, copy: bool = True) -> Optional[pd.DataFrame]:
+        """
+        Return all jobs, parsing jobs.csv only when it has changed on disk, or None if it doesn't exist.
+        Updates not yet flushed are carried over into a re-read frame. The cached frame is
+        replaced rather than modified, so a frame returned with copy=False stays consistent,
+        but pass copy=False only from methods that do not modify the returned frame.
+        """
+        with self._jobs_lock:
+            try:
+                mtime = os.stat(self.jobs_csv).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            
+            if self._jobs_df is None or mtime != self._jobs_mtime:
+                jobs_df = pd.read_csv(self.jobs_csv, dtype=_JOB_DTYPES, memory_map=True)
+                if self._dirty_job_ids and self._jobs_df is not None:
+                    jobs_df = self._merge_unflushed_jobs(jobs_df)
+                self._jobs_df = jobs_df
+                self._jobs_mtime = mtime
+            jobs_df = self._jobs_df
+        return jobs_df.copy() if copy else jobs_df
+    
+    def _merge_unflushed_jobs(self, jobs_df: pd.DataFrame) -> pd.DataFrame:
+        """Copy the progress of jobs with unflushed updates from the cached frame into a re-read one."""
+        cached = self._jobs_df[self._jobs_df['job_id'].isin(self._dirty_job_ids)]
+        cached = cached.drop_duplicates('job_id').set_index('job_id')[_JOB_PROGRESS_COLUMNS]
+        on_disk = jobs_df['job_id'].isin(cached.index).to_numpy()
+        for col in _JOB_PROGRESS_COLUMNS:
+            jobs_df.loc[on_disk, col] = jobs_df.loc[on_disk, 'job_id'].map(cached[col])
+        return jobs_df
+    
+    def _write_jobs(self, jobs_df: pd.DataFrame):
+        """Write all jobs to jobs.csv atomically and keep the written frame as the cache."""
+        _write_csv_atomic(jobs_df, self.jobs_csv)
+        self._jobs_df = jobs_df
+        self._jobs_mtime = os.stat(self.jobs_csv).st_mtime_ns
+        self._dirty_job_ids = set()
+        self._jobs_flushed_at = time.monotonic()
+    
+    @_with_jobs_lock
+    def flush_jobs(self) -> bool:
+        """Write job updates that are still only in memory to jobs.csv."""
+        try:
+            if self._dirty_job_ids:
+                self._write_jobs(self._jobs_df)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error flushing jobs: {str(e)}")
+            return False
     
+    @_with_jobs_lock
     def create_job(self, references_text: str, total_refs: int) -> str:
         """
         Create a new processing job.
@@ -493,16 +979,7 @@ class DatabaseManager:
             job_id = str(uuid.uuid4())
             current_time = datetime.now().isoformat()
             
-            # Read existing jobs
-            if os.path.exists(self.jobs_csv):
-                jobs_df = pd.read_csv(self.jobs_csv)
-            else:
-                jobs_df = pd.DataFrame(columns=[
-                    'job_id', 'status', 'total_refs', 'completed_refs', 'failed_refs',
-                    'created_at', 'updated_at', 'references_text'
-                ])
-            
-            # Add new job
+            # Append the new job without re-reading or rewriting existing jobs
             new_job = pd.DataFrame([{
                 'job_id': job_id,
                 'status': 'pending',
@@ -512,10 +989,14 @@ class DatabaseManager:
                 'created_at': current_time,
                 'updated_at': current_time,
                 'references_text': references_text
-            }])
+            }], columns=list(_JOB_DTYPES))
             
-            jobs_df = pd.concat([jobs_df, new_job], ignore_index=True)
-            jobs_df.to_csv(self.jobs_csv, index=False)
+            jobs_df = self._read_jobs(copy=False)
+            new_job.to_csv(self.jobs_csv, mode='a', header=False, index=False)
+            
+            # Extend the cached jobs to match the file, so the next read skips parsing
+            self._jobs_df = pd.concat([jobs_df, new_job], ignore_index=True)
+            self._jobs_mtime = os.stat(self.jobs_csv).st_mtime_ns
             
             logger.info(f"Created job {job_id} with {total_refs} references")
             return job_id
@@ -527,34 +1008,53 @@ class DatabaseManager:
     def get_job(self, job_id: str) -> Optional[Dict]:
         """Get job details by job_id."""
         try:
-            if not os.path.exists(self.jobs_csv):
+            jobs_df = self._read_jobs(copy=False)
+            if jobs_df is None:
                 return None
-                
-            jobs_df = pd.read_csv(self.jobs_csv)
-            job_row = jobs_df[jobs_df['job_id'] == job_id]
             
-            if job_row.empty:
+            positions = np.flatnonzero((jobs_df['job_id'] == job_id).to_numpy())
+            
+            if len(positions) == 0:
                 return None
                 
-            job = job_row.iloc[0].to_dict()
-            # Replace NaN with None
-            for key, value in job.items():
-                if pd.isna(value):
-                    job[key] = None
-                    
-            return job
+            return _row_to_dict(jobs_df, positions[0])
             
         except Exception as e:
             logger.error(f"Error getting job {job_id}: {str(e)}")
             return None
     
-    def update_job_status(self, job_id: str, status: str, completed_refs: int = None, failed_refs: int = None) -> bool:
-        """Update job status and progress."""
+    def list_jobs(self, limit: int = 20) -> List[Dict]:
+        """
+        Get the most recent jobs, newest first.
+        Only job metadata is returned; the references_text column is left out.
+        """
         try:
-            if not os.path.exists(self.jobs_csv):
+            jobs_df = self._read_jobs(copy=False)
+            if jobs_df is None:
+                return []
+            
+            # Sort by created_at descending, limit to recent jobs
+            jobs_df = jobs_df.sort_values('created_at', ascending=False).head(limit)
+            
+            return _to_records(jobs_df.drop(columns='references_text'))
+            
+        except Exception as e:
+            logger.error(f"Error listing jobs: {str(e)}")
+            return []
+    
+    @_with_jobs_lock
+    def update_job_status(self, job_id: str, status: str, completed_refs: int = None, failed_refs: int = None,
+                          total_refs: int = None) -> bool:
+        """
+        Update job status and progress.
+        Readers in this process see the update at once; jobs.csv is rewritten only when the job
+        reaches a final status or the last write is older than jobs_flush_interval.
+        """
+        try:
+            jobs_df = self._read_jobs()
+            if jobs_df is None:
                 return False
-                
-            jobs_df = pd.read_csv(self.jobs_csv)
+            
             mask = jobs_df['job_id'] == job_id
             
             if not mask.any():
@@ -569,8 +1069,15 @@ class DatabaseManager:
                 jobs_df.loc[mask, 'completed_refs'] = completed_refs
             if failed_refs is not None:
                 jobs_df.loc[mask, 'failed_refs'] = failed_refs
+            if total_refs is not None:
+                jobs_df.loc[mask, 'total_refs'] = total_refs
                 
-            jobs_df.to_csv(self.jobs_csv, index=False)
+            if (status in _FINAL_JOB_STATUSES
+                    or time.monotonic() - self._jobs_flushed_at >= self.jobs_flush_interval):
+                self._write_jobs(jobs_df)
+            else:
+                self._jobs_df = jobs_df
+                self._dirty_job_ids.add(job_id)
             
             logger.info(f"Updated job {job_id}: status={status}, completed={completed_refs}, failed={failed_refs}")
             return True
@@ -582,55 +1089,62 @@ class DatabaseManager:
     def add_job_result(self, job_id: str, reference_index: int, status: str, pmid: str = None, 
                       extracted_title: str = None, error_message: str = None) -> bool:
         """Add a result for a specific reference in a job."""
+        return self.add_job_results([{
+            'job_id': job_id,
+            'reference_index': reference_index,
+            'status': status,
+            'pmid': pmid,
+            'extracted_title': extracted_title,
+            'error_message': error_message
+        }])
+    
+    def add_job_results(self, results: List[Dict]) -> bool:
+        """
+        Add multiple job results with a single append to each job's results file.
+        Results may carry their own processed_at timestamp; otherwise the current time is used.
+        Earlier results are never re-read or rewritten, and jobs never wait on each other.
+        """
+        if not results:
+            return True
+        
         try:
-            self._init_job_results_csv()
-            
-            if os.path.exists(self.job_results_csv):
-                results_df = pd.read_csv(self.job_results_csv)
-            else:
-                results_df = pd.DataFrame(columns=[
-                    'job_id', 'reference_index', 'status', 'pmid', 'extracted_title', 
-                    'error_message', 'processed_at'
-                ])
-            
-            new_result = pd.DataFrame([{
-                'job_id': job_id,
-                'reference_index': reference_index,
-                'status': status,
-                'pmid': pmid,
-                'extracted_title': extracted_title,
-                'error_message': error_message,
-                'processed_at': datetime.now().isoformat()
-            }])
-            
-            results_df = pd.concat([results_df, new_result], ignore_index=True)
-            results_df.to_csv(self.job_results_csv, index=False)
+            self._init_job_results_dir()
+            
+            new_results = []
+            for result in results:
+                new_result = {col: result.get(col) for col in _JOB_RESULT_DTYPES}
+                if not new_result['processed_at']:
+                    new_result['processed_at'] = datetime.now().isoformat()
+                new_results.append(new_result)
+            
+            new_df = pd.DataFrame(new_results, columns=list(_JOB_RESULT_DTYPES))
+            for job_id, job_results in new_df.groupby('job_id', sort=False):
+                path = self._job_results_path(job_id)
+                if path is None:
+                    raise ValueError(f"Invalid job ID: {job_id!r}")
+                # Each job's results are written by its own processor thread only; the
+                # directory exists only once the legacy split is complete
+                with open(path, 'a', newline='', encoding='utf-8') as f:
+                    job_results.to_csv(f, header=f.tell() == 0, index=False)
             
             return True
             
         except Exception as e:
-            logger.error(f"Error adding job result for {job_id}: {str(e)}")
+            logger.error(f"Error adding job results: {str(e)}")
             return False
     
     def get_job_results(self, job_id: str) -> List[Dict]:
         """Get all results for a specific job."""
         try:
-            if not os.path.exists(self.job_results_csv):
+            self._init_job_results_dir()
+            
+            path = self._job_results_path(job_id)
+            if path is None or not os.path.exists(path):
                 return []
                 
-            results_df = pd.read_csv(self.job_results_csv)
-            job_results = results_df[results_df['job_id'] == job_id]
-            
-            results = []
-            for _, row in job_results.iterrows():
-                result = row.to_dict()
-                # Replace NaN with None
-                for key, value in result.items():
-                    if pd.isna(value):
-                        result[key] = None
-                results.append(result)
-                
-            return sorted(results, key=lambda x: x['reference_index'])
+            job_results = pd.read_csv(path, dtype=_JOB_RESULT_DTYPES, memory_map=True)
+            
+            return _to_records(job_results.sort_values('reference_index', kind='stable'))
             
         except Exception as e:
             logger.error(f"Error getting job results for {job_id}: {str(e)}")
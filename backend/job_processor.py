@@ -1,38 +1,89 @@
+import os
 import threading
-import time
 import logging
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional
 from datetime import datetime
 from reference_parser import ReferenceParser
 from pubmed_search import PubMedSearcher
 from content_downloader import ContentDownloader
 from database import DatabaseManager
+from corpus_paths import TXT_DIR, PDF_DIR, REF_DIR
 
 logger = logging.getLogger(__name__)
 
 class JobProcessor:
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, reference_parser: ReferenceParser = None,
+                 pubmed_searcher: PubMedSearcher = None, content_downloader: ContentDownloader = None,
+                 max_workers: int = 2, reference_workers: int = 8, entry_batch_size: int = 50,
+                 result_batch_size: int = 10):
         self.db_manager = db_manager
-        self.reference_parser = ReferenceParser()
-        self.pubmed_searcher = PubMedSearcher()
-        self.content_downloader = ContentDownloader()
-        self.processing_jobs = set()  # Track currently processing job IDs
+        # Reuse the caller's components when given instead of creating duplicates
+        self.reference_parser = reference_parser or ReferenceParser()
+        self.pubmed_searcher = pubmed_searcher or PubMedSearcher()
+        self.content_downloader = content_downloader or ContentDownloader()
+        self.entry_batch_size = entry_batch_size  # Entries buffered before writing to the database
+        self.result_batch_size = result_batch_size  # Job results buffered before writing to the database
+        self.processing_jobs = set()  # Track queued and currently processing job IDs
+        self.futures: Dict[str, Future] = {}  # Queued and running jobs by job ID, for cancellation
+        self.cancelled_jobs = set()  # Running jobs asked to stop after their current reference
+        # Guards processing_jobs, futures and cancelled_jobs between request, job and pool threads.
+        # Reentrant, since a done callback runs on the submitting thread if the job has already finished
+        self._state_lock = threading.RLock()
         self.stop_event = threading.Event()
+        self._existing_pmids_lock = threading.Lock()  # Guards duplicate checks across reference workers
+        # Worker pool acting as the job queue; extra jobs wait for a free worker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        # Separate pool so the TXT, PDF and reference downloads of a reference overlap
+        self.download_executor = ThreadPoolExecutor(max_workers=3 * reference_workers, thread_name_prefix='download-worker')
+        # References of a job are processed concurrently to overlap their network waits
+        self.reference_executor = ThreadPoolExecutor(max_workers=reference_workers, thread_name_prefix='reference-worker')
     
     def process_job_async(self, job_id: str):
-        """Start processing a job in a background thread."""
-        if job_id in self.processing_jobs:
-            logger.warning(f"Job {job_id} is already being processed")
-            return
-        
-        self.processing_jobs.add(job_id)
-        thread = threading.Thread(target=self._process_job, args=(job_id,))
-        thread.daemon = True
-        thread.start()
-        logger.info(f"Started background processing for job {job_id}")
+        """Queue a job for processing by the background worker pool."""
+        with self._state_lock:
+            if job_id in self.processing_jobs:
+                logger.warning(f"Job {job_id} is already being processed")
+                return
+            
+            self.processing_jobs.add(job_id)
+            future = self.executor.submit(self._process_job, job_id)
+            self.futures[job_id] = future
+            future.add_done_callback(lambda _: self._forget_future(job_id))
+        logger.info(f"Queued background processing for job {job_id}")
+    
+    def _forget_future(self, job_id: str):
+        """Drop the future of a job that has finished or was cancelled."""
+        with self._state_lock:
+            self.futures.pop(job_id, None)
+    
+    def _is_cancelled(self, job_id: str) -> bool:
+        """Return whether a running job has been asked to stop."""
+        with self._state_lock:
+            return job_id in self.cancelled_jobs
+    
+    def cancel_job(self, job_id: str) -> bool:
+        """
+        Cancel a job that is waiting in the queue, or ask a running job to stop
+        after its current reference. Returns False if the job is neither queued nor running.
+        """
+        with self._state_lock:
+            future = self.futures.get(job_id)
+            if future is None:
+                return False
+            
+            if future.cancel():
+                self.processing_jobs.discard(job_id)
+                logger.info(f"Removed job {job_id} from the queue")
+            else:
+                self.cancelled_jobs.add(job_id)
+                logger.info(f"Asked running job {job_id} to stop")
+            return True
     
     def _process_job(self, job_id: str):
         """Process a job in the background."""
+        pending_entries = []  # Entries waiting to be written in one batch
+        pending_results = []  # Job results waiting to be written in one batch
         try:
             # Get job details
             job = self.db_manager.get_job(job_id)
@@ -50,6 +101,8 @@ class JobProcessor:
             try:
                 references = self.reference_parser.parse_references(references_text)
                 logger.info(f"Job {job_id}: GPT parsed {len(references)} references")
+                # Replace the estimated reference count with the parsed count
+                self.db_manager.update_job_status(job_id, 'processing', total_refs=len(references))
             except Exception as e:
                 logger.error(f"Job {job_id}: GPT parsing failed: {str(e)}")
                 self.db_manager.update_job_status(job_id, 'failed')
@@ -59,43 +112,104 @@ class JobProcessor:
                 )
                 return
             
-            # Process each reference
+            # A DOI identifies an article more reliably than its title, so resolve DOIs to PMIDs first
+            doi_refs = [ref_data for ref_data in references if not ref_data.get('pmid') and ref_data.get('doi')]
+            for ref_data, pmid in zip(doi_refs, self.pubmed_searcher.get_pmids_by_doi([ref_data['doi'] for ref_data in doi_refs])):
+                if pmid:
+                    ref_data['pmid'] = pmid
+            
+            # References that already carry a PMID only need their details, not a title search
+            known_articles = self.pubmed_searcher.get_articles_by_pmid(
+                [ref_data['pmid'] for ref_data in references if ref_data.get('pmid')]
+            )
+            # A PMID that PubMed does not return (mistyped, invented by the parser, or a failed fetch)
+            # is not trusted; those references fall back to the title search with the rest
+            for ref_data in references:
+                if ref_data.get('pmid') and str(ref_data['pmid']) not in known_articles:
+                    logger.warning(f"Job {job_id}: PMID {ref_data['pmid']} was not found, searching by title instead")
+                    ref_data['pmid'] = None
+            
+            # Search PubMed for the remaining references up front using batched requests
+            unresolved = [ref_data for ref_data in references if not ref_data.get('pmid')]
+            logger.info(f"Job {job_id}: Searching PubMed for {len(unresolved)} references...")
+            search_results = iter(self.pubmed_searcher.search_articles_batch(
+                [ref_data.get('title') for ref_data in unresolved]
+            ))
+            pubmed_results = [
+                known_articles[str(ref_data['pmid'])] if ref_data.get('pmid') else next(search_results)
+                for ref_data in references
+            ]
+            
+            # Check every known PMID for duplicates with a single database read
+            existing_pmids = self.db_manager.pmid_exists_many(
+                [ref_data.get('pmid') for ref_data in references] +
+                [result['pmid'] for result in pubmed_results if result]
+            )
+            
+            # Resolve PMC IDs for all new articles with batched elink requests
+            pmc_ids = self.content_downloader.get_pmc_ids_batch(
+                [result['pmid'] for result in pubmed_results if result and str(result['pmid']) not in existing_pmids]
+            )
+            
+            # Process references concurrently; results are recorded in order on this thread
+            futures = [
+                self.reference_executor.submit(
+                    self._process_single_reference, ref_data, pubmed_results[i], existing_pmids, pmc_ids
+                )
+                for i, ref_data in enumerate(references)
+            ]
             completed_refs = 0
             failed_refs = 0
             
             for i, ref_data in enumerate(references):
-                if self.stop_event.is_set():
+                if self.stop_event.is_set() or self._is_cancelled(job_id):
                     logger.info(f"Job {job_id}: Processing stopped")
+                    self._discard_references(job_id, futures[i:])
                     break
                 
-                logger.info(f"Job {job_id}: Processing reference {i+1}/{len(references)}")
-                
                 try:
-                    result = self._process_single_reference(ref_data)
+                    result = futures[i].result()
+                    logger.info(f"Job {job_id}: Processed reference {i+1}/{len(references)}")
+                    
+                    if result.get('entry_data'):
+                        pending_entries.append(result['entry_data'])
                     
                     if result['status'] == 'success':
                         completed_refs += 1
-                        self.db_manager.add_job_result(
+                        pending_results.append(self._job_result(
                             job_id, i, 'success', 
                             pmid=result.get('pmid'),
                             extracted_title=ref_data.get('title')
-                        )
+                        ))
+                    elif result['status'] == 'duplicate':
+                        completed_refs += 1
+                        pending_results.append(self._job_result(
+                            job_id, i, 'duplicate',
+                            pmid=result.get('pmid'),
+                            extracted_title=ref_data.get('title'),
+                            error_message=result.get('message')
+                        ))
                     else:
                         failed_refs += 1
-                        self.db_manager.add_job_result(
+                        pending_results.append(self._job_result(
                             job_id, i, 'failed',
                             extracted_title=ref_data.get('title'),
                             error_message=result.get('message', 'Unknown error')
-                        )
+                        ))
                         
                 except Exception as e:
                     logger.error(f"Job {job_id}: Error processing reference {i+1}: {str(e)}")
                     failed_refs += 1
-                    self.db_manager.add_job_result(
+                    pending_results.append(self._job_result(
                         job_id, i, 'error',
                         extracted_title=ref_data.get('title'),
                         error_message=str(e)
-                    )
+                    ))
+                
+                if len(pending_entries) >= self.entry_batch_size:
+                    self._flush_entries(pending_entries)
+                if len(pending_results) >= self.result_batch_size:
+                    self._flush_results(pending_results)
                 
                 # Update job progress
                 self.db_manager.update_job_status(
@@ -103,12 +217,15 @@ class JobProcessor:
                     completed_refs=completed_refs, 
                     failed_refs=failed_refs
                 )
-                
-                # Brief pause to avoid overwhelming APIs
-                time.sleep(0.1)
             
-            # Mark job as completed
-            final_status = 'completed' if completed_refs > 0 else 'failed'
+            self._flush_entries(pending_entries)
+            self._flush_results(pending_results)
+            
+            # Mark job as completed; a cancelled job keeps its status over the progress updates above
+            if self._is_cancelled(job_id):
+                final_status = 'cancelled'
+            else:
+                final_status = 'completed' if completed_refs > 0 else 'failed'
             self.db_manager.update_job_status(
                 job_id, final_status,
                 completed_refs=completed_refs,
@@ -122,25 +239,90 @@ class JobProcessor:
             self.db_manager.update_job_status(job_id, 'failed')
             
         finally:
-            self.processing_jobs.discard(job_id)
+            # Don't lose entries and results buffered before an unexpected error
+            self._flush_entries(pending_entries)
+            self._flush_results(pending_results)
+            self.db_manager.flush_jobs()
+            with self._state_lock:
+                self.processing_jobs.discard(job_id)
+                self.cancelled_jobs.discard(job_id)
     
-    def _process_single_reference(self, ref_data: Dict) -> Dict:
-        """Process a single reference (similar to existing process_single_reference)."""
-        try:
-            # Check for duplicate PMID
-            if ref_data.get('pmid') and self.db_manager.pmid_exists(ref_data['pmid']):
-                return {
-                    'status': 'duplicate',
-                    'pmid': ref_data['pmid'],
-                    'message': 'PMID already exists in database'
-                }
+    def _discard_references(self, job_id: str, futures: List[Future]):
+        """
+        Cancel the references of a stopped job that have not started, and wait for the rest
+        so the files they downloaded can be deleted, since no entries are recorded for them.
+        """
+        removed = 0
+        for future in futures:
+            if future.cancel():
+                continue
+            try:
+                result = future.result()
+            except Exception:
+                continue
             
-            # Search PubMed
-            pubmed_result = self.pubmed_searcher.search_article(ref_data['title'])
+            filename = (result.get('entry_data') or {}).get('filename')
+            if result['status'] != 'success' or not filename:
+                continue
+            for path in (os.path.join(TXT_DIR, f'{filename}.txt'),
+                         os.path.join(PDF_DIR, f'{filename}.pdf'),
+                         os.path.join(REF_DIR, f'{filename}_ref.txt')):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Job {job_id}: Could not remove {path}: {str(e)}")
+        
+        if removed:
+            logger.info(f"Job {job_id}: Removed {removed} files downloaded for unrecorded references")
+    
+    def _flush_entries(self, pending_entries: List[Dict]):
+        """Write buffered entries to the database in one batch and clear the buffer."""
+        if pending_entries:
+            self.db_manager.add_entries(pending_entries)
+            pending_entries.clear()
+    
+    def _flush_results(self, pending_results: List[Dict]):
+        """Write buffered job results to the database in one batch and clear the buffer."""
+        if pending_results:
+            self.db_manager.add_job_results(pending_results)
+            pending_results.clear()
+    
+    def _job_result(self, job_id: str, reference_index: int, status: str, **fields) -> Dict:
+        """Build a job result row, stamped with the time the reference finished rather than when it is written."""
+        return {
+            'job_id': job_id,
+            'reference_index': reference_index,
+            'status': status,
+            'processed_at': datetime.now().isoformat(),
+            **fields
+        }
+    
+    def _process_single_reference(self, ref_data: Dict, pubmed_result: Optional[Dict], existing_pmids: set,
+                                  pmc_ids: Optional[Dict[str, Optional[str]]] = None) -> Dict:
+        """
+        Process a single reference using its (possibly empty) PubMed search result.
+        existing_pmids holds PMIDs already stored and is updated with newly processed ones.
+        pmc_ids maps PMIDs to PMC IDs resolved in advance; other PMIDs are looked up on demand.
+        """
+        try:
+            # Check for duplicate PMID, claiming new ones so concurrent workers skip them
+            known_pmid = ref_data.get('pmid') or (pubmed_result or {}).get('pmid')
+            with self._existing_pmids_lock:
+                if known_pmid and str(known_pmid) in existing_pmids:
+                    return {
+                        'status': 'duplicate',
+                        'pmid': known_pmid,
+                        'message': 'PMID already exists in database'
+                    }
+                if pubmed_result:
+                    existing_pmids.add(str(pubmed_result['pmid']))
             
             if not pubmed_result:
-                # Save failed extraction
-                self.db_manager.add_entry({
+                # Failed extraction is saved by the caller
+                entry_data = {
                     'pmid': None,
                     'filename': None,
                     'extraction_status': 'pubmed_search_failed',
@@ -150,23 +332,36 @@ class JobProcessor:
                     'original_reference': ref_data['original_text'],
                     'extracted_title': ref_data['title'],
                     'found_title': None,
-                    'first_author': ref_data.get('first_author', '')
-                })
+                    'first_author': ref_data.get('first_author', ''),
+                    'created_at': datetime.now().isoformat()
+                }
                 return {
                     'status': 'failed',
                     'step': 'pubmed_search',
-                    'message': f"PubMed search failed for: {ref_data['title']}"
+                    'message': f"PubMed search failed for: {ref_data['title']}",
+                    'entry_data': entry_data
                 }
             
             # Download content if available
             pmid = pubmed_result['pmid']
             filename = f"{ref_data['first_author']}_{pmid}"
             
-            txt_downloaded = self.content_downloader.download_fulltext(pmid, filename)
-            pdf_downloaded = self.content_downloader.download_pdf(pmid, filename)
-            ref_downloaded = self.content_downloader.download_references(pmid, filename)
+            pmc_ids = pmc_ids or {}
+            if str(pmid) in pmc_ids and not pmc_ids[str(pmid)]:
+                # Not in PMC, so there is nothing to download
+                logger.info(f"No PMC ID found for PMID {pmid}")
+                txt_downloaded = pdf_downloaded = ref_downloaded = False
+            else:
+                # The three downloads are independent, so run them concurrently
+                pmc_id = pmc_ids.get(str(pmid))
+                txt_future = self.download_executor.submit(self.content_downloader.download_fulltext, pmid, filename, pmc_id)
+                pdf_future = self.download_executor.submit(self.content_downloader.download_pdf, pmid, filename, pmc_id)
+                ref_future = self.download_executor.submit(self.content_downloader.download_references, pmid, filename, pmc_id)
+                txt_downloaded = txt_future.result()
+                pdf_downloaded = pdf_future.result()
+                ref_downloaded = ref_future.result()
             
-            # Save to database
+            # Entry is saved to the database by the caller
             entry_data = {
                 'pmid': pmid,
                 'filename': filename,
@@ -180,18 +375,21 @@ class JobProcessor:
                 'first_author': ref_data.get('first_author', ''),
                 'journal': pubmed_result.get('journal', ''),
                 'year': pubmed_result.get('year', ''),
-                'doi': pubmed_result.get('doi', '')
+                'doi': pubmed_result.get('doi', ''),
+                'created_at': datetime.now().isoformat(),
+                # Store the batched PMC lookup so later reference extraction can skip elink
+                'pmc_id': pmc_ids.get(str(pmid)),
+                'pmc_lookup_at': datetime.now().isoformat() if str(pmid) in pmc_ids else None
             }
             
-            self.db_manager.add_entry(entry_data)
-            
             return {
                 'status': 'success',
                 'pmid': pmid,
                 'title': pubmed_result.get('title', ''),
                 'txt_downloaded': txt_downloaded,
                 'pdf_downloaded': pdf_downloaded,
-                'ref_downloaded': ref_downloaded
+                'ref_downloaded': ref_downloaded,
+                'entry_data': entry_data
             }
             
         except Exception as e:
@@ -206,6 +404,14 @@ class JobProcessor:
         self.stop_event.set()
         logger.info("Signaled all job processors to stop")
     
+    def close(self):
+        """Stop accepting jobs and wait for queued and running jobs to finish, then shut down the worker pools."""
+        self.executor.shutdown(wait=True)
+        self.reference_executor.shutdown(wait=True)
+        self.download_executor.shutdown(wait=True)
+        logger.info("Job processor shut down")
+    
     def get_processing_jobs(self) -> List[str]:
         """Get list of currently processing job IDs."""
-        return list(self.processing_jobs)
\ No newline at end of file
+        with self._state_lock:
+            return list(self.processing_jobs)
\ No newline at end of file
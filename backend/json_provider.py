@@ -0,0 +1,22 @@
+import json
+from typing import Any, Union
+import orjson
+from flask.json.provider import JSONProvider
+
+class ORJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson.
+    Used by jsonify, so large entry lists and job results serialize in native code.
+    NaN values are written as null and numpy scalars from pandas rows are handled directly.
+    """
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=str, option=self.option).decode('utf-8')
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # Fall back to the stdlib parser for input orjson rejects (e.g. NaN literals)
+            return json.loads(s, **kwargs)
@@ -1,75 +1,223 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-import xml.etree.ElementTree as ET
+import os
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree as ET
 from typing import Dict, Optional, List
 import logging
 import urllib.parse
 import re
+from cache import PersistentTTLCache, hash_key
 
 logger = logging.getLogger(__name__)
 
+# libxml2 parser shared by all E-utilities responses; batched efetch responses can be large
+_XML_PARSER = ET.XMLParser(huge_tree=True)
+# Article fields of a PubmedArticle, compiled once and evaluated in C. Full child paths
+# avoid walking the whole article (MeSH headings, reference lists) for every field.
+_ARTICLE_TITLE_XPATH = ET.XPath('MedlineCitation/Article/ArticleTitle')
+_AUTHOR_XPATH = ET.XPath('MedlineCitation/Article/AuthorList/Author')
+_JOURNAL_TITLE_XPATH = ET.XPath('MedlineCitation/Article/Journal/Title')
+_JOURNAL_ABBREVIATION_XPATH = ET.XPath('MedlineCitation/Article/Journal/ISOAbbreviation')
+_PUB_YEAR_XPATH = ET.XPath('MedlineCitation/Article/Journal/JournalIssue/PubDate/Year')
+_MEDLINE_DATE_XPATH = ET.XPath('MedlineCitation/Article/Journal/JournalIssue/PubDate/MedlineDate')
+_DOI_XPATH = ET.XPath('MedlineCitation/Article/ELocationID[@EIdType="doi"]')
+_ABSTRACT_XPATH = ET.XPath('MedlineCitation/Article/Abstract/AbstractText')
+
+def _first(xpath: ET.XPath, elem) -> Optional[ET._Element]:
+    """Evaluate a compiled XPath and return its first matching element, or None."""
+    matches = xpath(elem)
+    return matches[0] if matches else None
+
+# Words of three or more letters considered for keyword search strategies
+_WORD_RE = re.compile(r'\b[a-zA-Z]{3,}\b')
+# Year within a MedlineDate such as "2020 Jan-Feb"
+_YEAR_RE = re.compile(r'\d{4}')
+# Words left out of keyword searches
+_SEARCH_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 
+    'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
+    'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those'
+})
+# Words ignored when comparing titles
+_MATCH_STOP_WORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were'})
+
 class PubMedSearcher:
     def __init__(self):
         self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
-        self.last_request_time = 0
-        self.rate_limit_delay = 0.34  # Just over 1/3 second to ensure max 3 requests per second
+        self.last_request_time = 0  # time.monotonic() of the last request, immune to wall-clock changes
+        # An NCBI API key raises the E-utilities limit from 3 to 10 requests per second
+        self.api_key = os.getenv('NCBI_API_KEY')
+        self.rate_limit_delay = 0.11 if self.api_key else 0.34
+        self._rate_limit_lock = threading.Lock()  # Batch searches issue requests concurrently
+        self.search_workers = 4  # Concurrent title searches in search_articles_batch
+        
+        # Reuse connections across requests instead of a new TCP/TLS handshake per call
+        self.session = requests.Session()
+        # Retry throttled and transient server errors with backoff instead of failing the search
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+        self.session.headers['Connection'] = 'keep-alive'
+        self.batch_size = 200  # Max PMIDs per efetch request
+        # Identify ourselves to NCBI as recommended by the E-utilities guidelines
+        self.tool = 'pmid-preprocess'
+        self.email = os.getenv('NCBI_EMAIL')
+        # Cache title lookups on disk so references seen in earlier jobs or runs skip PubMed entirely.
+        # Titles that were not found are cached as {} for a shorter time.
+        project_root = os.path.dirname(os.path.dirname(__file__))
+        self.title_cache = PersistentTTLCache(
+            os.path.join(project_root, 'pubmed_cache.jsonl'), ttl=30 * 24 * 60 * 60, maxsize=16384
+        )
+        self.not_found_ttl = 24 * 60 * 60
+    
+    def _eutils_params(self, params: Dict) -> Dict:
+        """Add the tool/email identification parameters and the API key to an E-utilities request."""
+        params['tool'] = self.tool
+        if self.email:
+            params['email'] = self.email
+        if self.api_key:
+            params['api_key'] = self.api_key
+        return params
     
     def _rate_limit(self):
-        """Ensure we don't exceed 3 requests per second as per PubMed guidelines."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        
-        if time_since_last < self.rate_limit_delay:
-            sleep_time = self.rate_limit_delay - time_since_last
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
+        """Ensure we don't exceed the NCBI request rate (3 per second, or 10 with an API key)."""
+        with self._rate_limit_lock:
+            current_time = time.monotonic()
+            time_since_last = current_time - self.last_request_time
+            
+            if time_since_last < self.rate_limit_delay:
+                sleep_time = self.rate_limit_delay - time_since_last
+                time.sleep(sleep_time)
+            
+            self.last_request_time = time.monotonic()
     
-    def search_article(self, title: str, authors: str = None) -> Optional[Dict]:
+    def search_articles_batch(self, titles: List[str]) -> List[Optional[Dict]]:
         """
-        Search PubMed for an article using title and optionally authors.
-        Returns article information with PMID if found.
+        Search PubMed for a list of titles.
+        Strategies are tried in rounds: each round runs the next search strategy for every
+        title still without a good match, then fetches the details of all candidate PMIDs
+        of the round in batched efetch calls.
+        Searches for different titles run concurrently within the shared rate limit.
+        Returns a list of article information (or None) aligned with the input titles.
         """
-        if not title:
-            return None
+        results = [None] * len(titles)
+        strategies_by_index = {}
+        failed_searches = set()  # Titles with a failed request, which are not cached as not found
         
-        try:
-            # Build all search query strategies
-            search_strategies = self._build_all_search_strategies(title, authors)
+        for i, title in enumerate(titles):
+            if not title:
+                continue
+            
+            cached_result = self.title_cache.get(hash_key('pubmed:title', f"{title}|"))
+            if cached_result is not None:
+                logger.info(f"Using cached PubMed result for title: {title}")
+                results[i] = cached_result or None
+                continue
             
-            # Try each strategy until we find results
-            for i, search_query in enumerate(search_strategies):
-                logger.info(f"Trying search strategy {i+1}: {search_query}")
+            try:
+                strategies_by_index[i] = self._build_all_search_strategies(title)
+            except Exception as e:
+                logger.error(f"Error searching PubMed for title '{title}': {str(e)}")
+        
+        def search(i, strategy):
+            query = strategies_by_index[i][strategy]
+            logger.info(f"Trying search strategy {strategy + 1}: {query}")
+            try:
+                return self._search_pubmed(query)
+            except Exception as e:
+                logger.error(f"Error searching PubMed for title '{titles[i]}': {str(e)}")
+                return None
+        
+        unmatched = list(strategies_by_index)
+        strategy = 0
+        details_by_pmid = {}  # Kept across rounds so a PMID found again is not fetched again
+        # The searches wait on the network, so overlap them; _rate_limit still spaces the requests
+        with ThreadPoolExecutor(max_workers=self.search_workers) as executor:
+            while unmatched:
+                round_indexes = [i for i in unmatched if strategy < len(strategies_by_index[i])]
+                if not round_indexes:
+                    break
                 
-                search_results = self._search_pubmed(search_query)
+                # Step 1: One esearch per title using this round's strategy
+                candidates = {}
+                for i, pmids in zip(round_indexes, executor.map(lambda i: search(i, strategy), round_indexes)):
+                    if pmids is None:
+                        failed_searches.add(i)
+                    elif pmids:
+                        candidates[i] = pmids[0]
+                    else:
+                        logger.info(f"No results with strategy {strategy + 1}")
                 
-                if search_results:
-                    # Step 2: Get detailed information for the first result
-                    pmid = search_results[0]
-                    article_details = self._get_article_details(pmid)
-                    
-                    if article_details and self._is_good_match(title, article_details['title']):
-                        logger.info(f"Found matching article with strategy {i+1}: PMID {pmid}")
-                        return {
-                            'pmid': pmid,
-                            'title': article_details['title'],
-                            'authors': article_details.get('authors', []),
-                            'journal': article_details.get('journal', ''),
-                            'year': article_details.get('year', ''),
-                            'doi': article_details.get('doi', ''),
-                            'abstract': article_details.get('abstract', '')
-                        }
-                    elif article_details:
-                        logger.info(f"Found article but poor title match with strategy {i+1}: '{article_details['title']}'")
-                else:
-                    logger.info(f"No results with strategy {i+1}")
-            
-            logger.info(f"No matching articles found for title: {title}")
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error searching PubMed for title '{title}': {str(e)}")
-            return None
+                # Step 2: Fetch details for all new candidates in as few requests as possible
+                details_by_pmid.update(self._get_articles_details_batch(
+                    [pmid for pmid in set(candidates.values()) if pmid not in details_by_pmid]
+                ))
+                
+                # Step 3: Match titles; the rest move on to the next strategy
+                for i, pmid in candidates.items():
+                    article_details = details_by_pmid.get(pmid)
+                    if not article_details:
+                        failed_searches.add(i)
+                    elif self._is_good_match(titles[i], article_details['title']):
+                        logger.info(f"Found matching article with strategy {strategy + 1}: PMID {pmid}")
+                        results[i] = self._build_result(pmid, article_details)
+                        self.title_cache.set(hash_key('pubmed:title', f"{titles[i]}|"), results[i])
+                    else:
+                        logger.info(f"Found article but poor title match with strategy {strategy + 1}: '{article_details['title']}'")
+                
+                unmatched = [i for i in unmatched if results[i] is None]
+                strategy += 1
+        
+        for i in unmatched:
+            logger.info(f"No matching articles found for title: {titles[i]}")
+            if i not in failed_searches:
+                self.title_cache.set(hash_key('pubmed:title', f"{titles[i]}|"), {}, ttl=self.not_found_ttl)
+        
+        return results
+    
+    def get_articles_by_pmid(self, pmids: List[str]) -> Dict[str, Dict]:
+        """
+        Get article information for PMIDs that are already known, without searching.
+        Fetches details in batched efetch calls.
+        Returns a dictionary mapping each found PMID to its article information.
+        """
+        pmids = list(dict.fromkeys(str(pmid) for pmid in pmids if pmid))
+        details_by_pmid = self._get_articles_details_batch(pmids)
+        return {pmid: self._build_result(pmid, details) for pmid, details in details_by_pmid.items()}
+    
+    def get_pmids_by_doi(self, dois: List[str]) -> List[Optional[str]]:
+        """
+        Look up PMIDs by DOI with one esearch per DOI, run concurrently within the shared rate limit.
+        Returns a list of PMIDs (or None) aligned with the input DOIs; a DOI that matches
+        no article or more than one is treated as not found.
+        """
+        def search(doi):
+            logger.info(f"Searching PubMed by DOI: {doi}")
+            pmids = self._search_pubmed(f'"{doi}"[AID]', max_results=2)
+            return pmids[0] if pmids and len(pmids) == 1 else None
+        
+        if not dois:
+            return []
+        
+        with ThreadPoolExecutor(max_workers=self.search_workers) as executor:
+            return list(executor.map(search, dois))
+    
+    def _build_result(self, pmid: str, article_details: Dict) -> Dict:
+        """Build the search result returned to callers from parsed article details."""
+        return {
+            'pmid': pmid,
+            'title': article_details['title'],
+            'authors': article_details.get('authors', []),
+            'journal': article_details.get('journal', ''),
+            'year': article_details.get('year', ''),
+            'doi': article_details.get('doi', ''),
+            'abstract': article_details.get('abstract', '')
+        }
     
     def _build_all_search_strategies(self, title: str, authors: str = None) -> List[str]:
         """Build all search strategies to try in order of preference."""
@@ -104,94 +252,91 @@ class PubMedSearcher:
             author_clean = authors.replace(',', '').strip()
             strategies_with_author = [f'({query}) AND "{author_clean}"[Author]' for query in strategies]
             # Try with author first, then without
-            return strategies_with_author + strategies
+            strategies = strategies_with_author + strategies
         
-        return strategies
+        # Short titles can yield the same query from several strategies; search each once
+        return list(dict.fromkeys(strategies))
     
     
     def _extract_significant_words(self, title: str) -> list:
         """Extract significant words from title, removing common stop words."""
-        stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 
-            'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
-            'may', 'might', 'must', 'can', 'this', 'that', 'these', 'those'
-        }
-        
-        words = re.findall(r'\b[a-zA-Z]{3,}\b', title.lower())
-        significant = [word for word in words if word not in stop_words]
+        words = _WORD_RE.findall(title.lower())
+        significant = [word for word in words if word not in _SEARCH_STOP_WORDS]
         return significant[:8]  # Limit to 8 most significant words
     
-    def _search_pubmed(self, query: str, max_results: int = 5) -> List[str]:
+    def _search_pubmed(self, query: str, max_results: int = 5) -> Optional[List[str]]:
         """
         Search PubMed and return list of PMIDs.
+        Returns None if the request failed, as opposed to an empty list for no results.
         """
         self._rate_limit()
         
         search_url = f"{self.base_url}esearch.fcgi"
-        params = {
+        params = self._eutils_params({
             'db': 'pubmed',
             'term': query,
             'retmax': max_results,
-            'retmode': 'xml',
+            'retmode': 'json',
             'sort': 'relevance'
-        }
+        })
         
         try:
-            response = requests.get(search_url, params=params, timeout=30)
+            response = self.session.get(search_url, params=params, timeout=30)
             response.raise_for_status()
             
-            # Parse XML response
-            root = ET.fromstring(response.content)
-            pmids = []
-            
-            for id_elem in root.findall('.//Id'):
-                pmids.append(id_elem.text)
+            # esearch answers with a small JSON document; an error reply has no idlist
+            pmids = response.json()['esearchresult']['idlist']
             
             logger.info(f"Found {len(pmids)} PMIDs for query: {query}")
             return pmids
             
         except requests.RequestException as e:
             logger.error(f"Request error in PubMed search: {str(e)}")
-            return []
-        except ET.ParseError as e:
-            logger.error(f"XML parsing error in PubMed search: {str(e)}")
-            return []
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Unexpected response in PubMed search: {str(e)}")
+            return None
     
-    def _get_article_details(self, pmid: str) -> Optional[Dict]:
+    def _get_articles_details_batch(self, pmids: List[str]) -> Dict[str, Dict]:
         """
-        Get detailed article information using efetch.
+        Get detailed article information for many PMIDs using batched efetch calls.
+        Returns a dictionary mapping PMID to article details.
         """
-        self._rate_limit()
-        
+        details_by_pmid = {}
         fetch_url = f"{self.base_url}efetch.fcgi"
-        params = {
-            'db': 'pubmed',
-            'id': pmid,
-            'retmode': 'xml'
-        }
         
-        try:
-            response = requests.get(fetch_url, params=params, timeout=30)
-            response.raise_for_status()
+        for start in range(0, len(pmids), self.batch_size):
+            batch = pmids[start:start + self.batch_size]
+            self._rate_limit()
             
-            # Parse XML response
-            root = ET.fromstring(response.content)
-            article = root.find('.//PubmedArticle')
+            params = self._eutils_params({
+                'db': 'pubmed',
+                'id': ','.join(batch),
+                'retmode': 'xml'
+            })
             
-            if article is None:
-                return None
-            
-            # Extract article details
-            details = self._parse_article_xml(article)
-            return details
-            
-        except requests.RequestException as e:
-            logger.error(f"Request error fetching PMID {pmid}: {str(e)}")
-            return None
-        except ET.ParseError as e:
-            logger.error(f"XML parsing error for PMID {pmid}: {str(e)}")
-            return None
+            try:
+                response = self.session.get(fetch_url, params=params, timeout=60)
+                response.raise_for_status()
+                
+                # Stream the articles and match each back to its PMID, freeing parsed articles
+                # as we go so memory holds one article instead of the whole response tree
+                for _, article in ET.iterparse(io.BytesIO(response.content), tag='PubmedArticle', huge_tree=True):
+                    pmid = article.findtext('MedlineCitation/PMID')
+                    if pmid:
+                        details_by_pmid[pmid] = self._parse_article_xml(article)
+                    article.clear()
+                    while article.getprevious() is not None:
+                        del article.getparent()[0]
+                
+                logger.info(f"Fetched details for {len(batch)} PMIDs in one request")
+                
+            except requests.RequestException as e:
+                logger.error(f"Request error fetching PMID batch: {str(e)}")
+            except ET.XMLSyntaxError as e:
+                logger.error(f"XML parsing error for PMID batch: {str(e)}")
+        
+        return details_by_pmid
     
     def _parse_article_xml(self, article_elem) -> Dict:
         """
@@ -201,12 +346,12 @@ class PubMedSearcher:
         
         try:
             # Title
-            title_elem = article_elem.find('.//ArticleTitle')
+            title_elem = _first(_ARTICLE_TITLE_XPATH, article_elem)
             details['title'] = title_elem.text if title_elem is not None else ''
             
             # Authors
             authors = []
-            for author in article_elem.findall('.//Author'):
+            for author in _AUTHOR_XPATH(article_elem):
                 last_name = author.find('LastName')
                 fore_name = author.find('ForeName')
                 if last_name is not None:
@@ -217,19 +362,18 @@ class PubMedSearcher:
             details['authors'] = authors
             
             # Journal
-            journal_elem = article_elem.find('.//Journal/Title')
+            journal_elem = _first(_JOURNAL_TITLE_XPATH, article_elem)
             if journal_elem is None:
-                journal_elem = article_elem.find('.//Journal/ISOAbbreviation')
+                journal_elem = _first(_JOURNAL_ABBREVIATION_XPATH, article_elem)
             details['journal'] = journal_elem.text if journal_elem is not None else ''
             
             # Publication year
-            year_elem = article_elem.find('.//PubDate/Year')
+            year_elem = _first(_PUB_YEAR_XPATH, article_elem)
             if year_elem is None:
-                year_elem = article_elem.find('.//PubDate/MedlineDate')
+                year_elem = _first(_MEDLINE_DATE_XPATH, article_elem)
                 if year_elem is not None:
                     # Extract year from MedlineDate (e.g., "2020 Jan-Feb")
-                    import re
-                    year_match = re.search(r'\d{4}', year_elem.text)
+                    year_match = _YEAR_RE.search(year_elem.text)
                     details['year'] = year_match.group() if year_match else ''
                 else:
                     details['year'] = ''
@@ -237,11 +381,11 @@ class PubMedSearcher:
                 details['year'] = year_elem.text
             
             # DOI
-            doi_elem = article_elem.find('.//ELocationID[@EIdType="doi"]')
+            doi_elem = _first(_DOI_XPATH, article_elem)
             details['doi'] = doi_elem.text if doi_elem is not None else ''
             
             # Abstract
-            abstract_elem = article_elem.find('.//Abstract/AbstractText')
+            abstract_elem = _first(_ABSTRACT_XPATH, article_elem)
             details['abstract'] = abstract_elem.text if abstract_elem is not None else ''
             
         except Exception as e:
@@ -257,20 +401,15 @@ class PubMedSearcher:
         if not search_title or not found_title:
             return False
         
-        # Convert to lowercase and split into words
+        # Convert to lowercase, split into words and remove common stop words in place
         search_words = set(search_title.lower().split())
-        found_words = set(found_title.lower().split())
-        
-        # Remove common stop words
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were'}
-        search_words = search_words - stop_words
-        found_words = found_words - stop_words
+        search_words -= _MATCH_STOP_WORDS
         
         if not search_words:
             return False
         
-        # Calculate overlap ratio
-        overlap = len(search_words.intersection(found_words))
+        # Calculate overlap ratio; stop words in the found title can't overlap, so they need no filtering
+        overlap = len(search_words.intersection(found_title.lower().split()))
         ratio = overlap / len(search_words)
         
         logger.info(f"Title match ratio: {ratio:.2f} for '{search_title}' vs '{found_title}'")
@@ -1,133 +1,302 @@
 import os
 import re
+import json
+import hashlib
+import functools
 import openai
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
 import logging
+from cache import PersistentTTLCache, hash_key
 
 logger = logging.getLogger(__name__)
 
+# A line that may start a new numbered reference, e.g. "24 Smith J", "[3] Smith J" or "3. Smith J".
+# Wrapped lines such as "2020 Jan;382(1):10-20." match too, so _reference_starts checks the numbering
+_REFERENCE_START_RE = re.compile(r'^\s*(?:\[(?P<bracketed>\d+)\]|(?P<number>\d+)\.?)\s+[^\W\d]', re.MULTILINE)
+# How far the numbering may jump ahead between references, allowing for a few missing from the text
+_MAX_REFERENCE_NUMBER_GAP = 5
+_BLANK_LINE_RE = re.compile(r'\n\s*\n')
+_WHITESPACE_RE = re.compile(r'\s+')
+_NON_NAME_CHARS_RE = re.compile(r'[^\w\-]')
+_PMID_RE = re.compile(r'\d{1,9}')
+_DOI_RE = re.compile(r'10\.\d{4,9}/\S+')
+# Pieces of a Vancouver-style reference, e.g.
+# "24 Smith J, De Jong KL, et al. Title of the paper. N Engl J Med. 2020;12(3):123-130."
+_REFERENCE_NUMBER_RE = re.compile(r'^\s*(?:\[\d+\]|\d+\.?)\s+')
+_HYPHEN_WRAP_RE = re.compile(r'-[ \t]*\n\s*')
+_VANCOUVER_AUTHOR = r"[A-Z][\w'\-]*(?: [A-Z][\w'\-]*)* [A-Z]{1,3}"
+_VANCOUVER_RE = re.compile(
+    rf"(?P<authors>{_VANCOUVER_AUTHOR}(?:, {_VANCOUVER_AUTHOR})*(?:, et al)?)\. "
+    r"(?P<title>[^.?!]{15,}[.?!]) "
+    r"(?P<journal>[A-Z][^.;:]{0,100}?)\. "
+    r"(?P<year>(?:19|20)\d{2})(?=[ ;:.(])"
+)
+_PMID_IN_TEXT_RE = re.compile(r'\bPMID:?\s*(\d{1,9})\b')
+_DOI_IN_TEXT_RE = re.compile(r'(?:doi:\s*|doi\.org/)(10\.\d{4,9}/\S+)', re.IGNORECASE)
+
+# Instructions for _request_gpt_parse. They are the same on every call, so they go in the system
+# message and the user message carries only the references text
+_PARSE_SYSTEM_PROMPT = """You are a precise academic reference parser. The user message is a block of text containing one or more academic references. Identify each individual reference and extract, in input order:
+- title: The main title of the paper/article
+- first_author: The surname (last name) of the first author only
+- journal: The journal name if available
+- year: The publication year (4-digit number)
+- pmid: The PubMed ID, only if the reference text explicitly contains one (e.g. "PMID: 12345678")
+- doi: The DOI, only if the reference text explicitly contains one (e.g. "doi:10.1000/xyz123"), without any "doi:" or URL prefix
+- original_text: The original reference text as you found it
+
+RULES:
+- If any field cannot be determined, use null (not "null")
+- Never guess a pmid or doi that is not written in the reference
+- References may be numbered (like "66 Author..." or "[1] Author...") - ignore these numbers
+- The first author surname comes after any reference number
+- Extract only the surname, not initials or first names
+- Be careful not to confuse reference numbers with author names"""
+
+# Structured output schema for the parse, so the model can only return valid JSON of this shape
+_REFERENCE_FIELDS = ('title', 'first_author', 'journal', 'year', 'pmid', 'doi', 'original_text')
+_PARSE_RESPONSE_FORMAT = {
+    'type': 'json_schema',
+    'json_schema': {
+        'name': 'parsed_references',
+        'strict': True,
+        'schema': {
+            'type': 'object',
+            'properties': {
+                'references': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {field: {'type': ['string', 'null']} for field in _REFERENCE_FIELDS},
+                        'required': list(_REFERENCE_FIELDS),
+                        'additionalProperties': False
+                    }
+                }
+            },
+            'required': ['references'],
+            'additionalProperties': False
+        }
+    }
+}
+
+# Identifies the prompt and response schema in parse cache keys, so changing either
+# stops cached parses made with the old ones from being served
+_PARSE_PROMPT_DIGEST = hashlib.sha1(
+    (_PARSE_SYSTEM_PROMPT + json.dumps(_PARSE_RESPONSE_FORMAT, sort_keys=True)).encode('utf-8')
+).hexdigest()[:12]
+
+def _reference_starts(references_text: str) -> List[int]:
+    """
+    Return the offsets of the lines that start numbered references. A candidate line counts only
+    if its number follows the previous reference's within _MAX_REFERENCE_NUMBER_GAP, so years and
+    volumes at the start of wrapped lines are not taken for reference numbers.
+    """
+    starts = []
+    previous = None
+    for match in _REFERENCE_START_RE.finditer(references_text):
+        number = int(match.group('bracketed') or match.group('number'))
+        if previous is None or previous < number <= previous + _MAX_REFERENCE_NUMBER_GAP:
+            starts.append(match.start())
+            previous = number
+    return starts
+
+@functools.lru_cache(maxsize=4096)
+def _clean_author_name(author_name: str) -> str:
+    """Clean and format author name. Memoized, since the same surnames recur across references."""
+    if not author_name:
+        return "Unknown"
+    
+    # Replace spaces with dashes and clean up
+    cleaned = _WHITESPACE_RE.sub('-', author_name.strip())
+    # Remove any punctuation except dashes
+    cleaned = _NON_NAME_CHARS_RE.sub('', cleaned)
+    
+    return cleaned if cleaned else "Unknown"
+
 class ReferenceParser:
     def __init__(self, api_key=None):
         # Try to get API key from parameter or environment
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY must be provided as parameter or set as environment variable")
+        # One client for all calls, so its HTTP connection pool is reused across parses. A full
+        # batch generates in well under two minutes, so a stalled call is retried instead of
+        # holding a parse worker for the SDK's default ten minutes. The SDK retries rate limits,
+        # timeouts and server errors with jittered exponential backoff, honoring Retry-After
+        self.client = openai.OpenAI(api_key=self.api_key, timeout=120, max_retries=4)
+        # Long reference lists are parsed in concurrent GPT calls of this many references each,
+        # which keeps every response within max_tokens and overlaps the generation time
+        self.batch_size = 20
+        self.parse_workers = 4
+        # Short inputs with a few references go to the faster, cheaper model first,
+        # falling back to the main model if it fails or misses references
+        self.model = "gpt-4o"
+        self.small_model = "gpt-4o-mini"
+        self.small_input_chars = 800
+        self.small_input_refs = 3
+        # GPT parses are deterministic (temperature 0), so reruns of the same text reuse the stored result
+        project_root = os.path.dirname(os.path.dirname(__file__))
+        self.parse_cache = PersistentTTLCache(
+            os.path.join(project_root, 'gpt_parse_cache.jsonl'), ttl=90 * 24 * 60 * 60, maxsize=2048
+        )
+    
+    def estimate_count(self, references_text: str) -> int:
+        """
+        Cheaply estimate how many references a block of text contains without calling GPT.
+        Counts numbered reference lines, falling back to blank-line separated blocks.
+        """
+        if not references_text or not references_text.strip():
+            return 0
+        
+        numbered = len(_reference_starts(references_text))
+        if numbered:
+            return numbered
+        
+        blocks = [block for block in _BLANK_LINE_RE.split(references_text) if block.strip()]
+        return max(len(blocks), 1)
     
     def parse_references(self, references_text: str) -> List[Dict]:
         """
-        Parse a references section and extract individual references using GPT.
+        Parse a references section and extract individual references.
+        Numbered references in the common Vancouver style are parsed locally;
+        everything else is parsed with GPT. Raises if GPT parsing fails, so no
+        references are silently dropped.
         Returns a list of dictionaries with extracted information.
         """
         try:
-            return self._parse_all_references_with_gpt(references_text)
+            references = self._split_numbered_references(references_text)
+            parsed = [self._try_regex_parse(reference) for reference in references]
+            if not any(parsed):
+                return self._parse_with_gpt(references_text)
+            
+            remaining = [reference for reference, ref_data in zip(references, parsed) if ref_data is None]
+            logger.info(f"Parsed {len(references) - len(remaining)} of {len(references)} references without GPT")
+            if not remaining:
+                return parsed
+            
+            gpt_refs = self._parse_with_gpt(''.join(remaining))
+            if len(gpt_refs) != len(remaining):
+                # The GPT results can't be lined up with the leftover references, so parse
+                # the whole text with GPT to keep the references complete and in order
+                logger.warning(f"GPT returned {len(gpt_refs)} references for {len(remaining)}; parsing the whole text with GPT")
+                return self._parse_with_gpt(references_text)
+            
+            gpt_iter = iter(gpt_refs)
+            return [ref_data or next(gpt_iter) for ref_data in parsed]
             
         except Exception as e:
             logger.error(f"Error parsing references: {str(e)}")
             raise
     
+    def _split_numbered_references(self, references_text: str) -> List[str]:
+        """Split text into its numbered references, dropping any text before the first one. Returns [] if none are numbered."""
+        starts = _reference_starts(references_text)
+        bounds = starts + [len(references_text)]
+        return [references_text[start:end] for start, end in zip(bounds, bounds[1:])]
+    
+    def _try_regex_parse(self, reference: str) -> Optional[Dict]:
+        """
+        Parse a single reference in Vancouver style ("Authors. Title. Journal. Year;...") without GPT.
+        Returns None unless the authors, a title of at least 15 characters, the journal and the year all match.
+        """
+        text = _WHITESPACE_RE.sub(' ', _HYPHEN_WRAP_RE.sub('-', reference.strip()))
+        match = _VANCOUVER_RE.match(_REFERENCE_NUMBER_RE.sub('', text, count=1))
+        if not match:
+            return None
+        
+        # The first author is "Surname Initials"; keep the surname only
+        first_author = match.group('authors').split(',')[0].rsplit(' ', 1)[0]
+        pmid_match = _PMID_IN_TEXT_RE.search(text)
+        doi_match = _DOI_IN_TEXT_RE.search(text)
+        return {
+            'title': match.group('title').rstrip('.'),
+            'first_author': self._clean_author_name(first_author),
+            'journal': match.group('journal'),
+            'year': match.group('year'),
+            'pmid': pmid_match.group(1) if pmid_match else None,
+            'doi': self._clean_identifier(doi_match.group(1).rstrip('.,;'), _DOI_RE) if doi_match else None,
+            'original_text': text
+        }
+    
+    def _parse_with_gpt(self, references_text: str) -> List[Dict]:
+        """
+        Parse references with GPT, in concurrent batches when there are many.
+        Raises ValueError if any batch yields no references, rather than returning the
+        other batches' references as if they were all of them.
+        """
+        batches = self._split_batches(references_text)
+        if len(batches) == 1:
+            parsed_batches = [self._parse_all_references_with_gpt(references_text)]
+        else:
+            logger.info(f"Parsing references in {len(batches)} concurrent GPT batches")
+            with ThreadPoolExecutor(max_workers=min(self.parse_workers, len(batches))) as executor:
+                parsed_batches = list(executor.map(self._parse_all_references_with_gpt, batches))
+        
+        failed = [i + 1 for i, parsed in enumerate(parsed_batches) if not parsed]
+        if failed:
+            logger.error(f"GPT parsing failed for batch(es) {failed} of {len(batches)}")
+            raise ValueError(f"GPT parsing failed for {len(failed)} of {len(batches)} reference batches")
+        return [ref_data for parsed in parsed_batches for ref_data in parsed]
+    
+    def _split_batches(self, references_text: str) -> List[str]:
+        """
+        Split a references section into chunks of at most batch_size references, in order.
+        Uses numbered reference lines, falling back to blank-line separated blocks and then,
+        for a list with neither, to single lines; text that fits in one chunk is returned whole.
+        """
+        starts = _reference_starts(references_text)
+        if len(starts) > self.batch_size:
+            # Text before the first numbered line stays with the first chunk
+            bounds = [0] + starts[self.batch_size::self.batch_size] + [len(references_text)]
+            return [references_text[start:end] for start, end in zip(bounds, bounds[1:])]
+        
+        if not starts:
+            blocks = [block for block in _BLANK_LINE_RE.split(references_text) if block.strip()]
+            if len(blocks) > self.batch_size:
+                return ['\n\n'.join(blocks[i:i + self.batch_size]) for i in range(0, len(blocks), self.batch_size)]
+            
+            # One reference per line. A reference wrapped over several lines makes the batches
+            # smaller than batch_size references, and at worst is cut at a batch boundary
+            lines = [line for line in references_text.splitlines() if line.strip()]
+            if len(blocks) <= 1 and len(lines) > self.batch_size:
+                return ['\n'.join(lines[i:i + self.batch_size]) for i in range(0, len(lines), self.batch_size)]
+        
+        return [references_text]
+    
     def _parse_all_references_with_gpt(self, references_text: str) -> List[Dict]:
         """
         Use GPT to identify, split, and extract all references in a single call.
+        Results for text parsed before are served from the parse cache.
         """
+        # Keyed on the models and prompt as well as the text, whose case is kept since it is echoed back
+        cache_key = hash_key(
+            f"gpt:references:{self.small_model}:{self.model}:{_PARSE_PROMPT_DIGEST}",
+            _WHITESPACE_RE.sub(' ', references_text), ignore_case=False
+        )
+        cached_refs = self.parse_cache.get(cache_key)
+        if cached_refs is not None:
+            logger.info(f"Using cached GPT parse of {len(cached_refs)} references")
+            # Copies, since callers fill in fields such as the PMID
+            return [dict(ref_data) for ref_data in cached_refs]
+        
         try:
-            prompt = f"""
-You are tasked with parsing academic reference citations. Given a block of text containing multiple references, you need to:
-
-1. Identify and separate individual references
-2. Extract key information from each reference
-
-Input text:
-```
-{references_text}
-```
-
-For each reference you find, extract:
-- title: The main title of the paper/article
-- first_author: The surname (last name) of the first author only
-- journal: The journal name if available
-- year: The publication year (4-digit number)
-
-CRITICAL JSON FORMATTING RULES:
-- ALL string values MUST be properly escaped for JSON
-- Replace all " (double quotes) with \\" in string values
-- Replace all \\ (backslashes) with \\\\ in string values  
-- Replace all newlines with \\n in string values
-- Remove or replace any control characters
-- If any field cannot be determined, use null (not "null")
-- References may be numbered (like "66 Author..." or "[1] Author...") - ignore these numbers
-- The first author surname comes after any reference number
-- Extract only the surname, not initials or first names
-- Be careful not to confuse reference numbers with author names
-
-Return ONLY a valid JSON array where each object represents one reference:
-
-[
-  {{
-    "title": "extracted title or null",
-    "first_author": "author surname or null", 
-    "journal": "journal name or null",
-    "year": "4-digit year or null",
-    "original_text": "the original reference text as you found it"
-  }},
-  ...
-]
-
-CRITICAL: Return ONLY valid JSON with no additional text, explanations, or markdown formatting.
-"""
-
-            # Use modern OpenAI client
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a precise academic reference parser. Return valid JSON arrays only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                max_tokens=2000  # Increased for multiple references
-            )
-
-            content = response.choices[0].message.content.strip()
-            
-            # Parse JSON response
-            import json
-            try:
-                references_data = json.loads(content)
-            except json.JSONDecodeError as e:
-                logger.error(f"Initial JSON parsing failed: {e}")
-                # Fallback: try to extract JSON from response
-                json_match = re.search(r'\[.*\]', content, re.DOTALL)
-                if json_match:
-                    try:
-                        references_data = json.loads(json_match.group())
-                    except json.JSONDecodeError as e2:
-                        logger.error(f"Extracted JSON parsing also failed: {e2}")
-                        # Try to fix common JSON issues
-                        json_content = json_match.group()
-                        # Fix unescaped quotes and newlines
-                        json_content = self._fix_json_content(json_content)
-                        try:
-                            references_data = json.loads(json_content)
-                        except json.JSONDecodeError as e3:
-                            logger.error(f"Fixed JSON parsing still failed: {e3}")
-                            logger.error(f"Problematic content: {content[:1000]}...")
-                            raise ValueError(f"Could not parse JSON from GPT response: {e3}")
-                else:
-                    logger.error(f"No JSON array found in content: {content[:500]}...")
-                    raise ValueError("Could not find JSON array in GPT response")
+            cleaned_refs = None
+            expected_count = self.estimate_count(references_text)
+            if len(references_text) < self.small_input_chars and expected_count <= self.small_input_refs:
+                try:
+                    cleaned_refs = self._request_gpt_parse(references_text, self.small_model)
+                except Exception as e:
+                    logger.warning(f"{self.small_model} parse failed, retrying with {self.model}: {str(e)}")
+                if cleaned_refs is not None and len(cleaned_refs) < expected_count:
+                    logger.warning(f"{self.small_model} returned {len(cleaned_refs)} of {expected_count} references, retrying with {self.model}")
+                    cleaned_refs = None
             
-            # Clean and validate the extracted data
-            cleaned_refs = []
-            for ref_data in references_data:
-                cleaned_ref = {
-                    'title': ref_data.get('title', '').strip() if ref_data.get('title') else None,
-                    'first_author': self._clean_author_name(ref_data.get('first_author', '')),
-                    'journal': ref_data.get('journal', '').strip() if ref_data.get('journal') else None,
-                    'year': ref_data.get('year', '').strip() if ref_data.get('year') else None,
-                    'original_text': ref_data.get('original_text', '').strip() if ref_data.get('original_text') else ''
-                }
-                cleaned_refs.append(cleaned_ref)
+            if cleaned_refs is None:
+                cleaned_refs = self._request_gpt_parse(references_text, self.model)
             
+            if cleaned_refs:
+                self.parse_cache.set(cache_key, [dict(ref_data) for ref_data in cleaned_refs])
             return cleaned_refs
             
         except Exception as e:
@@ -135,84 +304,56 @@ CRITICAL: Return ONLY valid JSON with no additional text, explanations, or markd
             # Fallback to old method if GPT fails
             return self._fallback_to_old_parsing(references_text)
     
-    def _fix_json_content(self, json_content: str) -> str:
-        """
-        Fix common JSON parsing issues in GPT responses, particularly unescaped newlines.
-        """
-        try:
-            # Remove any markdown code block markers
-            json_content = re.sub(r'```json\s*|\s*```', '', json_content)
-            
-            # Remove any leading/trailing whitespace
-            json_content = json_content.strip()
-            
-            # The main issue is unescaped newlines in string values
-            # We need to fix these by escaping them properly
-            
-            # First, let's fix the most common issue: newlines in string values
-            # Look for patterns like "key": "value with\nnewline"
-            
-            import json
-            
-            # Try a different approach: parse character by character and fix as we go
-            fixed_content = ""
-            in_string = False
-            escape_next = False
-            quote_char = None
-            
-            i = 0
-            while i < len(json_content):
-                char = json_content[i]
-                
-                if escape_next:
-                    fixed_content += char
-                    escape_next = False
-                elif char == '\\':
-                    fixed_content += char
-                    escape_next = True
-                elif char == '"' and not in_string:
-                    # Starting a string
-                    in_string = True
-                    quote_char = char
-                    fixed_content += char
-                elif char == '"' and in_string:
-                    # Ending a string
-                    in_string = False
-                    quote_char = None
-                    fixed_content += char
-                elif in_string and char == '\n':
-                    # Found unescaped newline in string - fix it
-                    fixed_content += '\\n'
-                elif in_string and char == '\r':
-                    # Found unescaped carriage return in string - fix it
-                    fixed_content += '\\r'
-                elif in_string and char == '\t':
-                    # Found unescaped tab in string - fix it
-                    fixed_content += '\\t'
-                else:
-                    fixed_content += char
-                
-                i += 1
-            
-            return fixed_content
-            
-        except Exception as e:
-            logger.error(f"Error in _fix_json_content: {e}")
-            return json_content
+    def _request_gpt_parse(self, references_text: str, model: str) -> List[Dict]:
+        """Parse references with one call to the given model. Raises if the response is unusable."""
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": _PARSE_SYSTEM_PROMPT},
+                {"role": "user", "content": references_text}
+            ],
+            temperature=0,
+            max_tokens=4096,  # Room for a full batch of references
+            response_format=_PARSE_RESPONSE_FORMAT
+        )
 
+        choice = response.choices[0]
+        if choice.finish_reason == 'length':
+            raise ValueError("GPT response was cut off at max_tokens")
+        if choice.message.refusal:
+            raise ValueError(f"GPT refused to parse the references: {choice.message.refusal}")
+        
+        # Structured output guarantees valid JSON matching the schema
+        references_data = json.loads(choice.message.content)['references']
+        
+        # Clean and validate the extracted data
+        cleaned_refs = []
+        for ref_data in references_data:
+            cleaned_ref = {
+                'title': ref_data.get('title', '').strip() if ref_data.get('title') else None,
+                'first_author': self._clean_author_name(ref_data.get('first_author', '')),
+                'journal': ref_data.get('journal', '').strip() if ref_data.get('journal') else None,
+                'year': ref_data.get('year', '').strip() if ref_data.get('year') else None,
+                'pmid': self._clean_identifier(ref_data.get('pmid'), _PMID_RE),
+                'doi': self._clean_identifier(ref_data.get('doi'), _DOI_RE),
+                'original_text': ref_data.get('original_text', '').strip() if ref_data.get('original_text') else ''
+            }
+            cleaned_refs.append(cleaned_ref)
+        
+        return cleaned_refs
+    
     def _fallback_to_old_parsing(self, references_text: str) -> List[Dict]:
         """Fallback method - returns empty list since old parsing is removed."""
         logger.error("GPT parsing failed and fallback is not available")
         return []
 
+    def _clean_identifier(self, value, pattern: re.Pattern) -> Optional[str]:
+        """Return an extracted PMID or DOI if it has the expected form, otherwise None."""
+        if not value:
+            return None
+        value = str(value).strip()
+        return value if pattern.fullmatch(value) else None
+    
     def _clean_author_name(self, author_name: str) -> str:
         """Clean and format author name."""
-        if not author_name:
-            return "Unknown"
-        
-        # Replace spaces with dashes and clean up
-        cleaned = re.sub(r'\s+', '-', author_name.strip())
-        # Remove any punctuation except dashes
-        cleaned = re.sub(r'[^\w\-]', '', cleaned)
-        
-        return cleaned if cleaned else "Unknown"
\ No newline at end of file
+        return _clean_author_name(author_name)
\ No newline at end of file
@@ -21,6 +21,19 @@ interface Entry {
   created_at: string;
 }
 
+// Content is requested as text, so a JSON error body from the server arrives unparsed
+const textErrorMessage = (err: any, fallback: string): string => {
+  const data = err.response?.data;
+  if (typeof data !== 'string') {
+    return data?.error || fallback;
+  }
+  try {
+    return JSON.parse(data).error || fallback;
+  } catch {
+    return fallback;
+  }
+};
+
 const EntriesBrowser: React.FC = () => {
   const [entries, setEntries] = useState<Entry[]>([]);
   const [filteredEntries, setFilteredEntries] = useState<Entry[]>([]);
@@ -156,10 +169,10 @@ const EntriesBrowser: React.FC = () => {
     setModalContent('');
     
     try {
-      const response = await axios.get(`http://localhost:5000/api/content/txt/${entry.pmid}`);
-      setModalContent(response.data.content);
+      const response = await axios.get(`http://localhost:5000/api/content/txt/${entry.pmid}`, { responseType: 'text' });
+      setModalContent(response.data);
     } catch (err: any) {
-      setModalError(err.response?.data?.error || 'Failed to load content');
+      setModalError(textErrorMessage(err, 'Failed to load content'));
     } finally {
       setModalLoading(false);
     }
@@ -187,10 +200,10 @@ const EntriesBrowser: React.FC = () => {
     setModalContent('');
     
     try {
-      const response = await axios.get(`http://localhost:5000/api/content/ref/${entry.pmid}`);
-      setModalContent(response.data.content);
+      const response = await axios.get(`http://localhost:5000/api/content/ref/${entry.pmid}`, { responseType: 'text' });
+      setModalContent(response.data);
     } catch (err: any) {
-      setModalError(err.response?.data?.error || 'Failed to load references');
+      setModalError(textErrorMessage(err, 'Failed to load references'));
     } finally {
       setModalLoading(false);
     }